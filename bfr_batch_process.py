@@ -11,46 +11,198 @@ and synched with the audio into an MP4 container.
 TO DO: Integrate the ffmpeg code in create_movie.sh into the python3
 source. Right now we call ffmpeg from the shell.
 """
+import dataclasses
 import logging
 import time
 import sys
 import multiprocessing as mp
 # Utility imports
-from bfr_utils_BETA import (mel_spec, get_config, clean_tmp_files, get_cli_args,
-get_wav_file_names, do_singles)
+from bfr_utils_BETA import (get_config, get_cli_args,
+get_wav_file_names, do_singles, do_batch, init_worker, build_stages,
+probe_rate)
+from bfr_settings import load_settings
+from bfr_threads import plan_budget, cpu_seconds, report_utilization
+from bfr_manifest import (load_manifest, save_manifest, settings_hash,
+                          filter_files, record_file, SAVE_INTERVAL)
+from bfr_scratch import pick_scratch_root, make_run_dir, remove_dir
+from bfr_memory import report_peaks
+from bfr_scheduler import (run_stages, parse_stage_workers, pool_chunksize,
+                           log_progress)
 
 
 def bfr() -> None:
     """
     Created:    2021-11-08
     Author:     robertdcurrier@gmail.com
-    Modified:   2022-11-07
+    Modified:   2026-10-18
     Notes:      Moving to doing single file movies...
+                Config and CLI are parsed and validated ONCE here and the
+                resulting settings are handed to the workers. Pool size
+                and per-worker threads come from the core budget.
+                Files the manifest says are up to date are skipped;
+                when that leaves none we return before the pool.
+                Intermediates go to a private scratch dir for this run,
+                so several targets can run at once.
+                -S runs each stage in its own pool instead; see
+                bfr_scheduler. Either way results stream back as files
+                finish and go into the manifest as they arrive.
+                batch_size > 1 hands workers batches of files whose
+                spectrograms are done in one go; see bfr_stft.
+                noise_model targets hand workers the background from
+                bfr_noise and fold each file's floors back into it.
     """
     config = get_config()
     args = get_cli_args()
     target = args['target']
+    budget = plan_budget(args['cores'], args['workers'])
     try:
-        wav_dir = config['targets'][target]["wav_dir"]
-    except KeyError:
-        logging.warning('Invalid target %s', target)
-        sys.exit()    
+        settings = load_settings(config, target,
+                                 encode_profile=args['encode_profile'],
+                                 threads=budget['threads'],
+                                 scratch_root=args['scratch_root'],
+                                 batch_size=args['batch_size'])
+        stage_workers = parse_stage_workers(args['stage_workers'])
+    except ValueError as e:
+        logging.warning('bfr(): Bad settings for %s: %s', target, e)
+        sys.exit()
 
     wav_files = []
-    wav_files = get_wav_file_names(wav_dir)
+    wav_files = get_wav_file_names(settings.wav_dir)
+    manifest = load_manifest(settings.processed_dir)
+    config_hash = settings_hash(settings)
+    if not args['force']:
+        wav_files = filter_files(manifest, wav_files, config_hash)
     num_files = len(wav_files)
+    if not wav_files:
+        logging.info('bfr(): Nothing to do for %s', target)
+        return num_files
     # Use Multiprocessing to expedite across all cores
-    pool = mp.Pool()
-    pool.map(do_singles, wav_files)
+    scratch_root = pick_scratch_root(settings.scratch_root, budget['workers'])
+    run_dir = make_run_dir(scratch_root, target)
+    settings = dataclasses.replace(settings, tmp_dir=run_dir)
+    # Workers build their mel basis etc. for this rate before the first
+    # file. The first header that reads will do; the noise model is keyed
+    # on it
+    rate = next(filter(None, map(probe_rate, wav_files)), None)
+    noise = None
+    noise_background = None
+    if settings.noise_model and rate is None:
+        # A None rate never matches the stored key, and starting over
+        # would save an empty model on top of it
+        logging.warning('bfr(): No readable WAV rate for %s, leaving the '
+                        'noise model alone this run', target)
+    elif settings.noise_model:
+        # numpy; only noise_model targets pay for it
+        from bfr_noise import load_noise, background
+        noise = load_noise(settings.processed_dir, settings, rate)
+        noise_background = background(noise)
+        logging.info('bfr(): Noise model for %s has %d floors', target,
+                     len(noise["floors"]))
+    cpu_start = cpu_seconds()
+    wall_start = time.time()
+    try:
+        if args['staged']:
+            stages = build_stages(settings, budget['cores'], stage_workers,
+                                  rate, noise_background)
+            results = run_stages(({"file": file} for file in wav_files),
+                                 stages)
+            collect_results(results, num_files, manifest, config_hash,
+                            settings.processed_dir, budget['workers'], noise)
+        else:
+            pool = mp.Pool(budget['workers'], initializer=init_worker,
+                           initargs=(settings, rate, noise_background),
+                           maxtasksperchild=args['max_tasks'])
+            try:
+                if settings.batch_size > 1:
+                    size = settings.batch_size
+                    batches = [wav_files[start:start + size] for start in
+                               range(0, num_files, size)]
+                    results = (result for batch in
+                               pool.imap_unordered(do_batch, batches)
+                               for result in batch)
+                else:
+                    chunksize = pool_chunksize(num_files, budget['workers'])
+                    results = pool.imap_unordered(do_singles, wav_files,
+                                                  chunksize)
+                collect_results(results, num_files, manifest, config_hash,
+                                settings.processed_dir, budget['workers'],
+                                noise)
+                pool.close()
+            except BaseException:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+    finally:
+        remove_dir(run_dir)
+    report_utilization(cpu_start, wall_start, time.time(), budget['cores'])
     return num_files
 
 
+def collect_results(results, num_files, manifest, config_hash, processed_dir,
+                    workers, noise=None):
+    """
+    Name:       collect_results
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Takes result records as the workers finish them. Each
+                good one goes into the manifest straight away and the
+                manifest is saved every SAVE_INTERVAL seconds and on the
+                way out, so a run that dies keeps what it got done.
+                Logs a files/min line per result, and at the end the
+                worst peak RSS per step over workers' files. Good
+                results' band floors go into the noise model, if there
+                is one, which is saved along with the manifest.
+    """
+    if noise is not None:
+        from bfr_noise import save_noise, add_floor
+    start_time = time.time()
+    last_save = start_time
+    done = 0
+    failed = 0
+    run_peaks = {}
+    try:
+        for result in results:
+            done += 1
+            timings = result.get("timings", {})
+            peaks = result.get("peaks", {})
+            for step, peak in peaks.items():
+                run_peaks[step] = max(peak, run_peaks.get(step, 0))
+            if result["ok"]:
+                record_file(manifest, result["file"], config_hash,
+                            result["sha1"], result["artifacts"])
+                if noise is not None and "noise" in result:
+                    add_floor(noise, result["file"], result["noise"])
+                logging.info('collect_results(): %s: %d ROIs in %0.1f s %s, '
+                             'peak %0.0f MB', result["file"], result["roi"],
+                             sum(timings.values()),
+                             " ".join("%s %0.1f" % (step, seconds) for
+                                      step, seconds in timings.items()),
+                             max(peaks.values(), default=0))
+            else:
+                failed += 1
+                logging.warning('collect_results(): %s failed: %s',
+                                result["file"],
+                                result.get("error", "ffmpeg_it failed"))
+            log_progress(done, failed, num_files, start_time)
+            if time.time() - last_save > SAVE_INTERVAL:
+                save_manifest(processed_dir, manifest)
+                if noise is not None:
+                    save_noise(processed_dir, noise)
+                last_save = time.time()
+    finally:
+        save_manifest(processed_dir, manifest)
+        if noise is not None:
+            save_noise(processed_dir, noise)
+    report_peaks(run_peaks, workers)
+    return done, failed
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
     start_time = time.time()
-    clean_tmp_files()
     num_files = bfr()
-    clean_tmp_files()
     end_time = time.time()
     minutes = ((end_time - start_time) / 60)
     logging.info('Processed %d files in %0.2f minutes', num_files, minutes)
@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+"""
+bfr_bench.py
+
+Author: robertdcurrier@gmail.com
+Created:    2026-10-18
+Modified:   2026-10-18
+Notes:      Benchmarks for the bfr pipeline. Nothing here touches
+            processed_dir; all output goes to a scratch dir that is
+            removed afterwards.
+
+            encode: seconds per encoded minute for each ENCODE_PROFILE
+            imports: python -X importtime for the bfr modules
+            startup: first file vs steady state per file, cold and warm
+            fft: configured n_fft vs next_fast_len for every target
+            coral: CORAL detection steps and the db detector on a quiet
+            and a noisy frame
+            combine: combine_wav over WAVs of mixed rate, width and
+            channels, checked as well as timed
+"""
+import argparse
+import dataclasses
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import statistics
+import multiprocessing as mp
+# Local imports
+from bfr_settings import load_settings, ENCODE_PROFILES
+from bfr_utils_BETA import (get_config, get_wav_file_names, ffmpeg_it,
+                            decode_file, mel_spec, header_footer,
+                            warm_worker, probe_rate, mel_db, gen_cons,
+                            gen_coral, gen_bboxes, seek_biologics_db,
+                            combine_wav)
+
+# Modules bench_imports times, and how long a bare import may take
+IMPORT_MODULES = ("bfr_utils_BETA", "bfr_utils", "bfr_batch_process")
+IMPORT_BUDGET = 0.5
+# Rate bench_fft assumes for targets with no WAVs to probe
+BENCH_RATE = 48000
+# White noise bench_coral adds for its noisy frame, as a multiple of the
+# recording's RMS
+CORAL_NOISE = 16.0
+# WAVs bench_combine mixes: rate, channels and sample type. int24 is
+# written by WavWriter, the rest by scipy.io.wavfile
+COMBINE_INPUTS = ((48000, 1, "int16"), (44100, 1, "int16"),
+                  (44100, 2, "float32"), (22050, 1, "float64"),
+                  (96000, 2, "int24"), (32000, 1, "uint8"),
+                  (44100, 1, "int32"))
+# Tone bench_combine writes, and how far its peak may drift through
+# resampling and requantizing
+COMBINE_TONE = 440.0
+COMBINE_PEAK = 0.5
+COMBINE_PEAK_TOL = 0.02
+# Set in each bench_startup worker by _startup_init
+init_seconds = 0.0
+
+
+def get_args():
+    """
+    Name:       get_args
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      bfr_bench.py <mode> -t target [-f wav_file]
+                imports and fft don't need a target.
+    """
+    arg_p = argparse.ArgumentParser()
+    arg_p.add_argument("mode", choices=["encode", "imports", "startup", "fft",
+                                        "coral", "combine"],
+                       help="what to benchmark")
+    arg_p.add_argument("-n", "--repeat", type=int, default=5,
+                       help="files per worker for startup, best of for coral, "
+                       "seconds per WAV for combine (default 5)")
+    arg_p.add_argument("-t", "--target", help="target as defined in config file")
+    arg_p.add_argument("-f", "--file", help="wav file (default: first in wav_dir)")
+    args = vars(arg_p.parse_args())
+    return args
+
+
+def bench_frame(settings, wav_file):
+    """
+    Name:       bench_frame
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Header + mel frame like header_footer builds. Uses the raw
+                mel PNG for wav_file from processed_dir if we have one,
+                otherwise noise, which is the worst case for x264.
+    """
+    import numpy as np
+    import cv2 as cv2
+    no_ext = os.path.splitext(os.path.basename(wav_file))[0]
+    raw_mel = "%s/%s_boosted_sox_mel.png" % (settings.processed_dir, no_ext)
+    image = cv2.imread(raw_mel)
+    if image is None:
+        logging.info('bench_frame(): No %s, using a noise frame', raw_mel)
+        image = np.random.randint(0, 256, (settings.frame_y, settings.frame_x, 3),
+                                  dtype=np.uint8)
+    image = cv2.resize(image, (settings.frame_x, settings.frame_y))
+    header = cv2.imread(settings.header)
+    if header is None:
+        header = np.zeros((settings.frame_y, settings.header_x, 3), np.uint8)
+    header = cv2.resize(header, (settings.header_x, settings.frame_y))
+    return np.append(header, image, axis=1)
+
+
+def bench_encode(settings, wav_file):
+    """
+    Name:       bench_encode
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Runs ffmpeg_it once per profile on the same frame and audio
+                and reports wall seconds per minute of encoded video.
+    """
+    frame = bench_frame(settings, wav_file)
+    minutes = settings.recording_seconds / 60
+    scratch = tempfile.mkdtemp(prefix='bfr_bench_')
+    try:
+        for profile in ENCODE_PROFILES:
+            bench_settings = dataclasses.replace(settings, processed_dir=scratch,
+                                                 encode_profile=profile)
+            start_time = time.time()
+            ok = ffmpeg_it(wav_file, bench_settings, frame)
+            elapsed = time.time() - start_time
+            no_ext = os.path.splitext(os.path.basename(wav_file))[0]
+            mp4_out = "%s/%s_processed.mp4" % (scratch, no_ext)
+            size = os.path.getsize(mp4_out) if ok else 0
+            logging.info('%-9s %7.2f s per encoded minute, %7.1f kB%s',
+                         profile, elapsed / minutes, size / 1024,
+                         '' if ok else ' (FAILED)')
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def parse_importtime(stderr):
+    """
+    Name:       parse_importtime
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      -X importtime lines -> [(self_us, cumulative_us, depth,
+                name)]. depth 0 is the module we imported, depth 1 what
+                it imports directly.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(parts[0]), int(parts[1]), depth, name.strip()))
+    return rows
+
+
+def bench_imports(top=8):
+    """
+    Name:       bench_imports
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Imports each of IMPORT_MODULES in a fresh interpreter and
+                reports import time, wall time for the whole interpreter
+                and the heaviest direct imports. Anything over
+                IMPORT_BUDGET is flagged: tooling that only lists files
+                or reads the config should never wait on librosa.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    for module in IMPORT_MODULES:
+        command = [sys.executable, "-X", "importtime", "-c",
+                   "import %s" % module]
+        start_time = time.time()
+        result = subprocess.run(command, cwd=here, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, text=True)
+        wall = time.time() - start_time
+        rows = parse_importtime(result.stderr)
+        if result.returncode != 0 or not rows:
+            logging.warning('bench_imports(): import %s failed: %s', module,
+                            result.stderr.strip().splitlines()[-1:])
+            continue
+        # Children are listed before their parent, so module's subtree
+        # is the run of indented rows just above its own row
+        end = [index for index, row in enumerate(rows)
+               if row[2] == 0 and row[3] == module][-1]
+        start = end
+        while start > 0 and rows[start - 1][2] > 0:
+            start -= 1
+        logging.info('%-18s %7.0f ms import, %7.0f ms wall%s', module,
+                     rows[end][1] / 1000, wall * 1000,
+                     ' (OVER BUDGET)' if wall > IMPORT_BUDGET else '')
+        direct = sorted((row for row in rows[start:end] if row[2] == 1),
+                        key=lambda row: row[1], reverse=True)
+        for row in direct[:top]:
+            logging.info('    %7.1f ms %s', row[1] / 1000, row[3])
+
+
+def _startup_init(settings, rate, warm):
+    """Pool initializer for bench_startup; notes how long it took."""
+    global init_seconds
+    start_time = time.perf_counter()
+    if warm:
+        warm_worker(settings, rate)
+    init_seconds = time.perf_counter() - start_time
+
+
+def _startup_file(wav_file, settings):
+    """decode + mel_spec + header_footer for one file, in seconds."""
+    start_time = time.perf_counter()
+    no_ext = os.path.splitext(os.path.basename(wav_file))[0]
+    bits, rate = decode_file(wav_file, settings)
+    sox_file = "%s/%s_boosted_sox.wav" % (settings.tmp_dir, no_ext)
+    mel_spec(sox_file, settings, bits, rate)
+    header_footer(sox_file, settings)
+    return time.perf_counter() - start_time, init_seconds
+
+
+def bench_startup(settings, wav_file, repeat):
+    """
+    Name:       bench_startup
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Runs the per-file CPU work (decode, mel_spec,
+                header_footer; no ffmpeg, no Mongo) repeat times in one
+                fresh spawned worker, cold and then with warm_worker as
+                its initializer. The first file minus the median of the
+                rest is the first-file spike; the median is the per-file
+                cost once everything is cached.
+    """
+    rate = probe_rate(wav_file)
+    scratch = tempfile.mkdtemp(prefix='bfr_bench_')
+    bench_settings = dataclasses.replace(settings, processed_dir=scratch,
+                                         tmp_dir=scratch, debug_dir=scratch)
+    context = mp.get_context('spawn')
+    try:
+        for warm in (False, True):
+            with context.Pool(1, initializer=_startup_init,
+                              initargs=(bench_settings, rate, warm)) as pool:
+                runs = [pool.apply(_startup_file, (wav_file, bench_settings))
+                        for _ in range(max(2, repeat))]
+            times = [run[0] for run in runs]
+            steady = statistics.median(times[1:])
+            logging.info('%-5s init %6.2f s, first file %6.2f s, then %6.2f s '
+                         'per file (spike %+0.2f s)', 'warm' if warm else 'cold',
+                         runs[0][1], times[0], steady, times[0] - steady)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _factors(number):
+    """16192 -> '2^6*11*23'"""
+    parts = []
+    factor = 2
+    while number > 1 and factor * factor <= number:
+        power = 0
+        while number % factor == 0:
+            number //= factor
+            power += 1
+        if power:
+            parts.append("%d^%d" % (factor, power) if power > 1 else str(factor))
+        factor += 1
+    if number > 1:
+        parts.append(str(number))
+    return "*".join(parts)
+
+
+def _best_of(repeat, func, *args, **kwargs):
+    """Fastest of repeat calls, in seconds."""
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func(*args, **kwargs)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_fft(config, repeat=5):
+    """
+    Name:       bench_fft
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      For every target in the config, times one recording's
+                worth of single threaded rffts at the n_fft the analysis
+                plan uses and at the fft_len fft_mode 'fast' would pad it
+                to. The rate comes from the target's first WAV, or
+                BENCH_RATE when there are none here.
+    """
+    import numpy as np
+    import scipy.fft
+    from bfr_dsp import analysis_plan, frame_count
+    rng = np.random.default_rng(0)
+    for target, block in sorted(config['targets'].items()):
+        try:
+            n_fft = block['n_fft']
+            hop_length = block['hop_length']
+            spec_fmax = block['spec_fmax']
+        except KeyError:
+            logging.info('%-26s no n_fft/hop_length/spec_fmax, skipped',
+                         target)
+            continue
+        wav_dir = block.get('wav_dir', '')
+        wav_files = get_wav_file_names(wav_dir) if os.path.isdir(wav_dir) else []
+        rate = (probe_rate(wav_files[0]) if wav_files else None) or BENCH_RATE
+        mode = block.get('analysis_mode', 'full')
+        plan = analysis_plan(rate, spec_fmax, n_fft, hop_length, mode, 'fast')
+        seconds = block.get('recording_seconds', 60)
+        count = frame_count(int(plan["rate"] * seconds), plan["n_fft"],
+                            plan["hop_length"])
+        frames = rng.standard_normal((count, plan["n_fft"])).astype(np.float32)
+        exact = _best_of(repeat, scipy.fft.rfft, frames, axis=-1, workers=1)
+        fast = _best_of(repeat, scipy.fft.rfft, frames, n=plan["fft_len"],
+                        axis=-1, workers=1)
+        logging.info('%-26s %-9s %6d Hz  n_fft %6d (%s) %8.1f ms   '
+                     'fast %6d (%s) %8.1f ms   %0.1fx', target, mode, rate,
+                     plan["n_fft"], _factors(plan["n_fft"]), exact * 1000,
+                     plan["fft_len"], _factors(plan["fft_len"]), fast * 1000,
+                     exact / fast)
+
+
+def bench_coral(settings, wav_file, repeat=5):
+    """
+    Name:       bench_coral
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Times the CORAL steps (gen_cons, the circle painting,
+                gen_coral as a whole, gen_bboxes) on wav_file's frame as
+                it is and with CORAL_NOISE times its RMS of white noise
+                mixed in, which is what gives gen_coral thousands of
+                contours. Then seek_biologics_db on the same dB matrix.
+                Best of repeat, debug images off.
+    """
+    import numpy as np
+    from bfr_detect import paint_circles
+    from bfr_render import render_mel
+    scratch = tempfile.mkdtemp(prefix='bfr_bench_')
+    bench_settings = dataclasses.replace(settings, debug=False,
+                                         debug_dir=scratch)
+    bits, rate = decode_file(wav_file, settings)
+    rms = float(np.sqrt(np.mean(np.square(bits, dtype=np.float64))))
+    noise = np.random.default_rng(0).standard_normal(len(bits))
+    frames = (("quiet", bits),
+              ("noisy", (bits + CORAL_NOISE * rms * noise).astype(np.float32)))
+    try:
+        for name, audio in frames:
+            mel_spec_db, mel_rate, hop_length = mel_db(audio, rate,
+                                                       bench_settings)
+            image = render_mel(mel_spec_db, settings.cmap, settings.frame_x,
+                               settings.frame_y)
+            png_file = "%s/%s.png" % (scratch, name)
+            cons = gen_cons(image, png_file, bench_settings)
+            circ_cons = gen_coral(image.copy(), cons, png_file, bench_settings)
+            bboxes = gen_bboxes(circ_cons, bench_settings)
+            logging.info('%-5s %dx%d %6d contours %5d ROIs   gen_cons %7.1f ms'
+                         '   circles %7.1f ms   gen_coral %7.1f ms   '
+                         'gen_bboxes %5.1f ms', name, settings.frame_x,
+                         settings.frame_y, len(cons), len(bboxes),
+                         1000 * _best_of(repeat, gen_cons, image, png_file,
+                                         bench_settings),
+                         1000 * _best_of(repeat, paint_circles, image.copy(),
+                                         cons, settings.taxa.radius_boost),
+                         1000 * _best_of(repeat, gen_coral, image.copy(), cons,
+                                         png_file, bench_settings),
+                         1000 * _best_of(repeat, gen_bboxes, circ_cons,
+                                         bench_settings))
+            rois = seek_biologics_db(mel_spec_db, mel_rate, hop_length,
+                                     png_file, bench_settings)
+            logging.info('%-5s %dx%d mel   %5d ROIs   db detector %7.1f ms',
+                         name, mel_spec_db.shape[1], mel_spec_db.shape[0],
+                         len(rois), 1000 * _best_of(
+                             repeat, seek_biologics_db, mel_spec_db,
+                             mel_rate, hop_length, png_file, bench_settings))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def bench_combine(settings, seconds=5):
+    """
+    Name:       bench_combine
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Writes a seconds long COMBINE_TONE WAV for each of
+                COMBINE_INPUTS to a scratch wav_dir and runs combine_wav
+                on them, so every append path gets exercised: the raw
+                copy, resampling, channel spreading and requantizing from
+                8/16/24/32 bit and float. Then checks the output took the
+                highest rate, channels and width, that each input's
+                stretch of it is as long as its resampled length, and
+                that the tone kept its level. Logs a warning per
+                problem.
+    """
+    import numpy as np
+    import scipy.io.wavfile
+    from bfr_wav import WavWriter, WavReader
+    scratch = tempfile.mkdtemp(prefix='bfr_bench_')
+    wav_dir = os.path.join(scratch, "wav")
+    os.makedirs(wav_dir)
+    bench_settings = dataclasses.replace(
+        settings, wav_dir=wav_dir, wav_out=os.path.join(scratch, "out.wav"))
+    try:
+        for index, (rate, channels, kind) in enumerate(COMBINE_INPUTS):
+            tone = COMBINE_PEAK * np.sin(2 * np.pi * COMBINE_TONE *
+                                         np.arange(seconds * rate) / rate)
+            tone = np.repeat(tone[:, None], channels, axis=1)
+            wav_file = "%s/%02d_%d_%s.wav" % (wav_dir, index, rate, kind)
+            if kind == "int24":
+                with WavWriter(wav_file, rate, channels, 24) as out:
+                    out.write(tone)
+                continue
+            if kind == "uint8":
+                data = np.round(tone * 127 + 128).astype(np.uint8)
+            elif kind.startswith("int"):
+                data = np.round(tone * np.iinfo(kind).max).astype(kind)
+            else:
+                data = tone.astype(kind)
+            scipy.io.wavfile.write(wav_file, rate, data)
+        start_time = time.perf_counter()
+        wav_out = combine_wav(bench_settings)
+        elapsed = time.perf_counter() - start_time
+        rate = max(entry[0] for entry in COMBINE_INPUTS)
+        channels = max(entry[1] for entry in COMBINE_INPUTS)
+        with WavReader(wav_out) as wav:
+            logging.info('combine: %d WAVs, %d s -> %d Hz %d ch %d bit, '
+                         '%0.1f s of audio in %0.2f s', len(COMBINE_INPUTS),
+                         seconds * len(COMBINE_INPUTS), wav.rate,
+                         wav.channels, wav.bits, wav.frames / wav.rate,
+                         elapsed)
+            if (wav.rate, wav.channels, wav.bits) != (rate, channels, 32):
+                logging.warning('combine: wanted %d Hz %d ch 32 bit', rate,
+                                channels)
+            start = 0
+            for entry in COMBINE_INPUTS:
+                frames = seconds * rate
+                block = wav.read_channels(start, start + frames)
+                # Skip the resampler's ramp in and out
+                edge = rate // 10
+                peak = float(np.abs(block[edge:-edge]).max())
+                if len(block) != frames:
+                    logging.warning('combine: %s is %d frames, wanted %d',
+                                    entry, len(block), frames)
+                if abs(peak - COMBINE_PEAK) > COMBINE_PEAK_TOL:
+                    logging.warning('combine: %s peaks at %0.3f, wanted %0.3f',
+                                    entry, peak, COMBINE_PEAK)
+                start += frames
+            if start != wav.frames:
+                logging.warning('combine: %d frames, wanted %d', wav.frames,
+                                start)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def init_app():
+    """
+    Kick it!
+    """
+    args = get_args()
+    if args['mode'] == 'imports':
+        bench_imports()
+        return
+    if args['mode'] == 'fft':
+        bench_fft(get_config())
+        return
+    if args['target'] is None:
+        logging.warning('init_app(): %s needs -t target', args['mode'])
+        sys.exit()
+    config = get_config()
+    try:
+        settings = load_settings(config, args['target'])
+    except ValueError as e:
+        logging.warning('init_app(): Bad settings: %s', e)
+        sys.exit()
+    wav_file = args['file']
+    if wav_file is None:
+        wav_files = get_wav_file_names(settings.wav_dir)
+        if len(wav_files) == 0:
+            logging.warning('init_app(): No wav files in %s', settings.wav_dir)
+            sys.exit()
+        wav_file = wav_files[0]
+    if args['mode'] == 'encode':
+        bench_encode(settings, wav_file)
+    if args['mode'] == 'startup':
+        bench_startup(settings, wav_file, args['repeat'])
+    if args['mode'] == 'coral':
+        bench_coral(settings, wav_file, args['repeat'])
+    if args['mode'] == 'combine':
+        bench_combine(settings, args['repeat'])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    init_app()
@@ -0,0 +1,270 @@
+"""
+
+Author: robertdcurrier@gmail.com
+Created:    2026-10-18
+Modified:   2026-10-18
+Notes:      ROI box handling on NumPy arrays. CORAL boxes are an
+            (N, 4) int32 array of x, y, width, height rows in mel PNG
+            pixels (y down). The db detector works on the mel dB matrix
+            instead: its regions are first frame, lowest mel bin, frames,
+            bins, and come out as start seconds, low Hz, seconds, Hz,
+            which is what annotate_mel draws.
+"""
+import logging
+import numpy as np
+
+BOX_DTYPE = np.int32
+
+
+def empty_boxes():
+    """(0, 4) box array."""
+    return np.zeros((0, 4), dtype=BOX_DTYPE)
+
+
+def contour_boxes(cons):
+    """
+    Name:       contour_boxes
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      cv2.boundingRect of every contour at once. All the points
+                go into one array and np.minimum/maximum.reduceat take
+                each contour's extent; width and height are inclusive
+                like boundingRect's.
+    """
+    lengths = np.fromiter(map(len, cons), dtype=np.intp, count=len(cons))
+    cons = [con for con, length in zip(cons, lengths) if length]
+    lengths = lengths[lengths > 0]
+    if not len(cons):
+        return empty_boxes()
+    points = np.concatenate(cons).reshape(-1, 2)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    low = np.minimum.reduceat(points, starts, axis=0)
+    high = np.maximum.reduceat(points, starts, axis=0)
+    return np.hstack((low, high - low + 1)).astype(BOX_DTYPE)
+
+
+def paint_circles(img, cons, radius_boost, color=(0, 0, 0)):
+    """
+    Name:       paint_circles
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Fills each contour's minimum enclosing circle, grown by
+                radius_boost, on img in place. What gen_coral used to do
+                inline. The circles stay exact: a box-centred circle per
+                contour done in bulk, or dilating the edges with a disk,
+                moves CORAL boxes by tens of pixels where circles only
+                just touch, and dilating per radius is slower than this
+                loop. minEnclosingCircle only needs the hull, so hand it
+                CHAIN_APPROX_SIMPLE contours.
+    """
+    import cv2 as cv2
+    for con in cons:
+        (x, y), radius = cv2.minEnclosingCircle(con)
+        cv2.circle(img, (int(x), int(y)), int(radius + radius_boost), color,
+                   -1)
+    return img
+
+
+def filter_boxes(boxes, taxa):
+    """
+    Name:       filter_boxes
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Keeps boxes strictly inside every min/max_roi_* bound:
+                width, height and area. Used to be width/height here and
+                area in the old bfr_utils.
+    """
+    width = boxes[:, 2]
+    height = boxes[:, 3]
+    area = width.astype(np.int64) * height
+    keep = ((width > taxa.min_roi_w) & (width < taxa.max_roi_w) &
+            (height > taxa.min_roi_h) & (height < taxa.max_roi_h) &
+            (area > taxa.min_roi_area) & (area < taxa.max_roi_area))
+    return boxes[keep]
+
+
+def dedupe_boxes(boxes):
+    """
+    Name:       dedupe_boxes
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Drops repeated boxes wherever they are, keeping first seen
+                order. Pixel boxes fit in 16 bits a side, so we pack each
+                into one uint64 and np.unique that, ~7x quicker than
+                np.unique(axis=0) on the rows.
+    """
+    if len(boxes) < 2:
+        return boxes
+    if boxes.min() >= 0 and boxes.max() < 1 << 16:
+        wide = boxes.astype(np.uint64)
+        keys = ((wide[:, 0] << 48) | (wide[:, 1] << 32) |
+                (wide[:, 2] << 16) | wide[:, 3])
+        _, first = np.unique(keys, return_index=True)
+    else:
+        _, first = np.unique(boxes, axis=0, return_index=True)
+    return boxes[np.sort(first)]
+
+
+def box_iou(boxes):
+    """(N, N) intersection over union of every pair of boxes."""
+    x1 = boxes[:, 0].astype(np.int64)
+    y1 = boxes[:, 1].astype(np.int64)
+    x2 = x1 + boxes[:, 2]
+    y2 = y1 + boxes[:, 3]
+    width = np.minimum(x2[:, None], x2) - np.maximum(x1[:, None], x1)
+    height = np.minimum(y2[:, None], y2) - np.maximum(y1[:, None], y1)
+    inter = np.clip(width, 0, None) * np.clip(height, 0, None)
+    area = (x2 - x1) * (y2 - y1)
+    union = area[:, None] + area - inter
+    return inter / np.maximum(union, 1)
+
+
+def merge_boxes(boxes, iou):
+    """
+    Name:       merge_boxes
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Replaces each group of boxes linked by IoU >= iou with
+                their union box, until no two boxes overlap that much.
+                Groups are the connected components of the IoU >= iou
+                graph, found by propagating the lowest index. Keeps the
+                order of each group's first box.
+    """
+    while len(boxes) > 1:
+        linked = box_iou(boxes) >= iou
+        labels = np.arange(len(boxes))
+        while True:
+            spread = np.where(linked, labels[None, :], len(boxes)).min(axis=1)
+            if np.array_equal(spread, labels):
+                break
+            labels = spread
+        groups = np.unique(labels)
+        if len(groups) == len(boxes):
+            break
+        x1 = boxes[:, 0]
+        y1 = boxes[:, 1]
+        x2 = x1 + boxes[:, 2]
+        y2 = y1 + boxes[:, 3]
+        lo_x = np.full(len(boxes), np.iinfo(BOX_DTYPE).max, dtype=BOX_DTYPE)
+        lo_y = lo_x.copy()
+        hi_x = np.zeros(len(boxes), dtype=BOX_DTYPE)
+        hi_y = hi_x.copy()
+        np.minimum.at(lo_x, labels, x1)
+        np.minimum.at(lo_y, labels, y1)
+        np.maximum.at(hi_x, labels, x2)
+        np.maximum.at(hi_y, labels, y2)
+        boxes = np.stack((lo_x[groups], lo_y[groups],
+                          hi_x[groups] - lo_x[groups],
+                          hi_y[groups] - lo_y[groups]), axis=1)
+    return boxes
+
+
+def select_boxes(boxes, taxa):
+    """
+    Name:       select_boxes
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      filter_boxes, dedupe_boxes, then merge_boxes if the taxa
+                sets merge_iou. A merged box can come out bigger than
+                max_roi_*; it stands for several ROIs that were each in
+                bounds.
+    """
+    found = len(boxes)
+    boxes = dedupe_boxes(filter_boxes(boxes, taxa))
+    if taxa.merge_iou > 0:
+        boxes = merge_boxes(boxes, taxa.merge_iou)
+    logging.debug('select_boxes(): %d boxes -> %d ROIs', found, len(boxes))
+    return boxes
+
+
+def noise_floor(mel_spec_db):
+    """Each mel band's noise floor: its median dB over the recording."""
+    return np.median(mel_spec_db, axis=1)
+
+
+def db_regions(mel_spec_db, floor, db_thresh):
+    """
+    Name:       db_regions
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Cells more than db_thresh above their band's floor, closed
+                with a 3x3 square so one call's ragged edges make one
+                region, and labelled by connectedComponentsWithStats.
+                Grana's algorithm gives the same stats as the default
+                ~2.5x quicker here. Returns the regions as an (N, 4)
+                int32 array of first frame, lowest mel bin, frames,
+                bins.
+    """
+    import cv2 as cv2
+    mask = (mel_spec_db > (floor + db_thresh)[:, None]).view(np.uint8)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+    _, _, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(
+        mask, 8, cv2.CV_32S, cv2.CCL_GRANA)
+    # Row 0 is the background
+    return stats[1:, :4].astype(BOX_DTYPE)
+
+
+def region_pixels(regions, shape, frame_x, frame_y):
+    """
+    Name:       region_pixels
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      db regions as the boxes they cover on the frame_x by
+                frame_y mel PNG, low bins at the bottom. For drawing
+                them on the debug image.
+    """
+    bins, frames = shape
+    x_scale = frame_x / frames
+    y_scale = frame_y / bins
+    left = np.floor(regions[:, 0] * x_scale)
+    right = np.ceil((regions[:, 0] + regions[:, 2]) * x_scale)
+    top = np.floor((bins - regions[:, 1] - regions[:, 3]) * y_scale)
+    bottom = np.ceil((bins - regions[:, 1]) * y_scale)
+    return np.stack((left, top, right - left, bottom - top),
+                    axis=1).astype(BOX_DTYPE)
+
+
+def mel_edges(n_mels, fmin, fmax):
+    """
+    Hz edges of the n_mels bands as specshow draws them: each band
+    centred on its mel_frequencies value, edges halfway between centres.
+    """
+    import librosa
+    centers = librosa.mel_frequencies(n_mels, fmin=fmin, fmax=fmax)
+    if n_mels < 2:
+        return np.array([fmin, fmax], dtype=np.float64)
+    middle = (centers[1:] + centers[:-1]) / 2
+    return np.concatenate(([2 * centers[0] - middle[0]], middle,
+                           [2 * centers[-1] - middle[-1]]))
+
+
+def region_axes(regions, rate, hop_length, edges):
+    """
+    Name:       region_axes
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      db regions as (N, 4) float64 start seconds, low Hz,
+                seconds, Hz. Frame n is centred on n * hop_length / rate
+                like specshow's time axis; edges is mel_edges().
+    """
+    frame_seconds = hop_length / rate
+    start = (regions[:, 0] - 0.5) * frame_seconds
+    low = edges[regions[:, 1]]
+    high = edges[regions[:, 1] + regions[:, 3]]
+    return np.stack((start, low, regions[:, 2] * frame_seconds, high - low),
+                    axis=1)
+
+
+def axes_bounds(boxes, taxa):
+    """Mask of the seconds/Hz boxes at least db_min_seconds by db_min_hz."""
+    return ((boxes[:, 2] >= taxa.db_min_seconds) &
+            (boxes[:, 3] >= taxa.db_min_hz))
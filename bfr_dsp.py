@@ -0,0 +1,382 @@
+"""
+
+Author: robertdcurrier@gmail.com
+Created:    2026-10-18
+Modified:   2026-10-18
+Notes:      In-memory audio chain for bfr. We decode each recording once
+            and do boost and filtering on the float array instead of
+            bouncing through pydub and sox temp WAVs.
+"""
+import functools
+import inspect
+import logging
+import numpy as np
+import librosa
+from scipy.fft import next_fast_len
+from scipy.io import wavfile
+from scipy.signal import butter, sosfilt, resample_poly, get_window
+# Local imports
+from bfr_wav import WavReader
+
+# librosa.core.load resamples to this when sr is left at the default.
+# The n_fft and hop_length settings in bfr_configs.cfg were tuned at it.
+SPEC_RATE = 22050
+# Headroom over 2 x spec_fmax for the anti-alias filter transition band
+DECIMATE_MARGIN = 1.25
+# How far the decimated hop may be off hop_length's seconds per frame
+DECIMATE_HOP_DRIFT = 0.01
+# Analysis settings we keep mel banks for; one per target is the norm
+MEL_CACHE_SIZE = 8
+# Complex STFT we hold at once. mel_power and bfr_stream work through the
+# frames in blocks of this size, starting at frame 0, so both give the
+# same floats for the same block
+STFT_BLOCK_BYTES = 32 * 1024 * 1024
+
+
+def load_audio(wav_file):
+    """
+    Name:       load_audio
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Decodes wav_file ONCE at its native rate. Returns mono
+                float32 samples in [-1, 1] and the sample rate. PCM
+                WAVs are read through the memory mapped WavReader,
+                which gives the same floats without soundfile's full
+                width buffer; anything else goes through librosa.
+    """
+    logging.debug('load_audio(): Decoding %s', wav_file)
+    try:
+        with WavReader(wav_file) as wav:
+            return wav.read(), wav.rate
+    except ValueError as e:
+        logging.debug('load_audio(): %s, using librosa', e)
+    bits, rate = librosa.core.load(wav_file, sr=None, mono=True,
+                                   dtype=np.float32)
+    return bits, rate
+
+
+def boost_filter(bits, rate, boost, lowpass, highpass):
+    """
+    Name:       boost_filter
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Replaces boost_audio + soxfilter. Gain is applied in dB and
+                clipped like pydub does on 16 bit audio. Lowpass is the
+                same 2-pole Butterworth sox uses by default. Highpass is
+                only applied when it sits below lowpass (a band); our
+                configs carry highpass > lowpass and sox never used it.
+    """
+    bits = np.asarray(bits, dtype=np.float32)
+    if boost:
+        bits = np.multiply(bits, np.float32(10 ** (boost / 20)))
+        np.clip(bits, -1.0, 1.0, out=bits)
+    for sos in filter_sections(rate, lowpass, highpass):
+        bits = sosfilt(sos, bits).astype(np.float32)
+    return bits
+
+
+def filter_sections(rate, lowpass, highpass):
+    """The Butterworth sections boost_filter runs, in order."""
+    sections = []
+    nyquist = rate / 2
+    if 0 < lowpass < nyquist:
+        logging.debug('filter_sections(): lowpass at %d Hz', lowpass)
+        sections.append(butter(2, lowpass, btype='lowpass', fs=rate,
+                               output='sos'))
+    if 0 < highpass < min(lowpass, nyquist):
+        logging.debug('filter_sections(): highpass at %d Hz', highpass)
+        sections.append(butter(2, highpass, btype='highpass', fs=rate,
+                               output='sos'))
+    return sections
+
+
+def resample_audio(bits, rate, target_rate=SPEC_RATE):
+    """
+    Name:       resample_audio
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Same resample librosa.core.load used to do for mel_spec.
+                Stays float32; astype is a no-op unless the resampler
+                handed back float64.
+    """
+    if rate == target_rate:
+        return bits, rate
+    bits = librosa.resample(bits, orig_sr=rate, target_sr=target_rate)
+    return bits.astype(np.float32, copy=False), target_rate
+
+
+def write_wav(wav_file, bits, rate):
+    """
+    Name:       write_wav
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Writes float samples as 16 bit PCM. Only needed when a
+                downstream tool (ffmpeg) has to read the audio from disk.
+    """
+    logging.debug('write_wav(): Writing %s', wav_file)
+    pcm = np.clip(bits, -1.0, 32767 / 32768)
+    pcm *= 32768
+    wavfile.write(wav_file, int(rate), pcm.astype(np.int16))
+    return wav_file
+
+
+def analysis_plan(rate, spec_fmax, n_fft, hop_length, analysis_mode='full',
+                  fft_mode='exact'):
+    """
+    Name:       analysis_plan
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Works out the rate we run the STFT at. 'full' is the old
+                behaviour: resample to SPEC_RATE and use n_fft/hop_length
+                as configured. 'decimated' drops the rate by an integer
+                factor q (decimate_factor) to above 2 x spec_fmax and
+                scales n_fft and hop_length by the same ratio, so Hz per
+                bin and seconds per frame stay close to where the config
+                put them at SPEC_RATE. With spec_fmax at 500 Hz that is
+                ~20x fewer samples and a ~20x shorter FFT.
+                plan["fft_len"] is the transform length. It is n_fft
+                unless fft_mode is 'fast', where each n_fft frame is
+                zero padded to scipy's next_fast_len: 16192 = 2^6*11*23
+                becomes 16200 = 2^3*3^4*5^2. The window, and so the
+                frequency resolution, stays n_fft, but the bins sit at
+                different frequencies and the mel filters sample them
+                differently. That changes the spectrogram, with the M117
+                settings at 48 kHz by over 1 dB in 34 of 256 mel rows and
+                up to 28 dB in one, and with it the ROIs. fast is not a
+                drop-in for exact; a target switching to it should be
+                checked and re-tuned.
+    """
+    plan = {"rate": SPEC_RATE, "q": 0, "n_fft": n_fft,
+            "hop_length": hop_length}
+    if analysis_mode == 'decimated':
+        q = decimate_factor(rate, spec_fmax, hop_length)
+        plan.update(decimate_plan(rate, q, n_fft, hop_length))
+    elif analysis_mode != 'full':
+        logging.warning('analysis_plan(): Unknown analysis_mode %s, using full',
+                        analysis_mode)
+    plan["fft_len"] = plan["n_fft"]
+    if fft_mode == 'fast':
+        plan["fft_len"] = next_fast_len(plan["n_fft"], real=True)
+    return plan
+
+
+def hop_drift(rate, q, hop_length):
+    """How far the decimated hop's whole samples are off, as a fraction."""
+    hop = hop_length * rate / (q * SPEC_RATE)
+    return abs(max(1, round(hop)) - hop) / hop
+
+
+def decimate_factor(rate, spec_fmax, hop_length):
+    """
+    Name:       decimate_factor
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      q for decimated analysis. The largest q that keeps rate / q
+                over 2 x spec_fmax x DECIMATE_MARGIN can leave the hop
+                well off a whole number of samples: M117 at 48 kHz with
+                hop 128 gets q 38 and a 7.33 sample hop, rounded to 7,
+                frames 4.5% shorter than hop_length says. So we step q
+                down, to no less than half that largest q (twice the
+                samples), until the hop is within DECIMATE_HOP_DRIFT:
+                q 35, hop 7.96 -> 8. If none is, the q with the least
+                drift, and we say so. Frame times downstream come from
+                the plan's hop, so they are right either way; this keeps
+                the frame spacing the config asked for.
+    """
+    top = max(1, int(rate // (2 * spec_fmax * DECIMATE_MARGIN)))
+    factors = range(top, max(1, top // 2) - 1, -1)
+    for q in factors:
+        if hop_drift(rate, q, hop_length) <= DECIMATE_HOP_DRIFT:
+            return q
+    q = min(factors, key=lambda q: hop_drift(rate, q, hop_length))
+    logging.info('decimate_factor(): No q puts hop %d at %d Hz within '
+                 '%0.0f%%; q %d is %0.1f%% off', hop_length, rate,
+                 100 * DECIMATE_HOP_DRIFT, q,
+                 100 * hop_drift(rate, q, hop_length))
+    return q
+
+
+def decimate_plan(rate, q, n_fft, hop_length):
+    """Rate, n_fft and hop_length for decimating rate by q."""
+    new_rate = rate / q
+    scale = new_rate / SPEC_RATE
+    plan = {"rate": new_rate, "q": q,
+            "n_fft": max(2, int(round(n_fft * scale))),
+            "hop_length": max(1, int(round(hop_length * scale)))}
+    logging.debug('decimate_plan(): %d Hz / %d -> %0.1f Hz, n_fft %d, hop %d '
+                  '(%0.1f%% off)', rate, q, new_rate, plan["n_fft"],
+                  plan["hop_length"], 100 * hop_drift(rate, q, hop_length))
+    return plan
+
+
+def prepare_analysis(bits, rate, plan):
+    """
+    Name:       prepare_analysis
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Gets samples to plan["rate"]. Decimation goes through
+                resample_poly, which runs a Kaiser windowed FIR anti-alias
+                filter ahead of the downsample.
+    """
+    if plan["q"] == 0:
+        return resample_audio(bits, rate, plan["rate"])
+    if plan["q"] == 1:
+        return bits, rate
+    bits = resample_poly(bits, 1, plan["q"]).astype(np.float32)
+    return bits, plan["rate"]
+
+
+@functools.lru_cache(maxsize=MEL_CACHE_SIZE)
+def stft_window(n_fft, window='hann'):
+    """Periodic window as librosa.stft builds it, cached per process."""
+    values = get_window(window, n_fft, fftbins=True).astype(np.float32)
+    values.flags.writeable = False
+    return values
+
+
+@functools.lru_cache(maxsize=MEL_CACHE_SIZE)
+def mel_bank(rate, n_fft, n_mels, fmin, fmax, window='hann', fft_len=None):
+    """
+    Name:       mel_bank
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Mel basis and STFT window for one set of analysis
+                settings, cached per process; warm_worker fills it before
+                the first file. The n_mels x (n_fft/2+1) basis is cropped
+                to the columns between the first and last FFT bins any
+                filter touches. With spec_fmax at 500 Hz and n_fft 16192
+                at 22050 Hz that is ~370 of 8097 columns. Returns
+                (basis, lo, hi, window), basis covering bins lo:hi. All
+                read only, as they're shared. fft_len (default n_fft) is
+                the transform length the basis is laid out for; the
+                window is always n_fft long.
+    """
+    fft_len = fft_len or n_fft
+    basis = librosa.filters.mel(sr=rate, n_fft=fft_len, n_mels=n_mels,
+                                fmin=fmin, fmax=fmax)
+    used = np.flatnonzero(basis.any(axis=0))
+    lo, hi = (int(used[0]), int(used[-1]) + 1) if used.size else (0, 0)
+    basis = np.ascontiguousarray(basis[:, lo:hi])
+    basis.flags.writeable = False
+    logging.debug('mel_bank(): %d Hz fft %d -> bins %d:%d of %d', rate,
+                  fft_len, lo, hi, fft_len // 2 + 1)
+    return basis, lo, hi, stft_window(n_fft, window)
+
+
+@functools.lru_cache(maxsize=None)
+def pad_mode():
+    """librosa.stft's default pad_mode; it went reflect -> constant in 0.10."""
+    return inspect.signature(librosa.stft).parameters['pad_mode'].default
+
+
+def frame_count(samples, n_fft, hop_length):
+    """Frames librosa.stft(center=True) gives for samples samples."""
+    return 1 + (samples + 2 * (n_fft // 2) - n_fft) // hop_length
+
+
+def block_frames(fft_len):
+    """STFT frames per block, so a block's spectrum is STFT_BLOCK_BYTES."""
+    return max(1, STFT_BLOCK_BYTES // ((fft_len // 2 + 1) * 8))
+
+
+def mel_power(bits, rate, n_fft, hop_length, n_mels, fmin, fmax, power,
+              window='hann', fft_len=None):
+    """
+    Name:       mel_power
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      librosa.feature.melspectrogram with the window and mel
+                basis coming from mel_bank. Same padding and centering,
+                as we let librosa.stft pick its defaults. Only the bins
+                the filters use get the abs/power and the projection.
+                With fft_len > n_fft librosa centers the n_fft window in
+                an fft_len frame, which has the same magnitudes as zero
+                padding the n_fft frame.
+                The frames go through mel_block block_frames at a time,
+                so at n_fft 16192/hop 32 we hold 32 MB of complex STFT
+                instead of GBs. bfr_stream feeds mel_block the same
+                blocks from disk.
+    """
+    fft_len = fft_len or n_fft
+    bank = mel_bank(rate, n_fft, n_mels, fmin, fmax, window, fft_len)
+    bits = np.asarray(bits, dtype=np.float32)
+    count = frame_count(len(bits), fft_len, hop_length)
+    padded = np.pad(bits, fft_len // 2, mode=pad_mode())
+    mel = np.empty((n_mels, count), dtype=np.float32)
+    block = block_frames(fft_len)
+    for start in range(0, count, block):
+        stop = min(count, start + block)
+        segment = padded[start * hop_length:(stop - 1) * hop_length + fft_len]
+        mel[:, start:stop] = mel_block(segment, bank, fft_len, hop_length,
+                                       power)
+    return mel
+
+
+def mel_block(segment, bank, fft_len, hop_length, power):
+    """
+    Name:       mel_block
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Mel power of every frame in segment, a slice of the
+                center padded signal starting on a frame boundary. bank
+                is what mel_bank returned.
+    """
+    basis, lo, hi, values = bank
+    stft = librosa.stft(segment, n_fft=fft_len, hop_length=hop_length,
+                        win_length=len(values), window=values, center=False,
+                        dtype=np.complex64)
+    spec = np.abs(stft[lo:hi])
+    del stft
+    band_power(spec, power)
+    return np.dot(basis, spec)
+
+
+def band_power(spec, power):
+    """spec ** power in place; float32 stays float32."""
+    if power == 2:
+        np.square(spec, out=spec)
+    elif power != 1:
+        np.power(spec, spec.dtype.type(power), out=spec)
+    return spec
+
+
+def amplitude_db(spec, amin=1e-5, top_db=80.0, levels=None):
+    """
+    Name:       amplitude_db
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      librosa.amplitude_to_db(spec, ref=np.max) done in place in
+                spec's own float32 buffer. librosa allocates a magnitude
+                copy, a dB copy and the top_db clip on top of that; on a
+                long Corona Chorus file each is tens of MB. Same steps in
+                the same order, so the result is bit for bit librosa's.
+                spec must be non-negative (mel power is) and writeable.
+                A levels dict gets what the noise model needs, which the
+                result no longer has: "floor", each band's median in dB
+                re 1.0 before the top_db clip, and "ref_db", the dB re
+                1.0 that the result's 0 dB stands for.
+    """
+    ref_value = spec.max()
+    np.square(spec, out=spec)
+    np.maximum(spec, amin ** 2, out=spec)
+    np.log10(spec, out=spec)
+    spec *= 10.0
+    ref_db = 10.0 * np.log10(np.maximum(amin ** 2, ref_value ** 2))
+    if levels is not None:
+        levels["floor"] = np.median(spec, axis=1)
+        levels["ref_db"] = float(ref_db)
+    spec -= ref_db
+    if top_db is not None:
+        np.maximum(spec, spec.max() - top_db, out=spec)
+    return spec
@@ -0,0 +1,184 @@
+"""
+
+Author: robertdcurrier@gmail.com
+Created:    2026-10-18
+Modified:   2026-10-18
+Notes:      Per-target output manifest so reruns only touch new or
+            changed recordings. Lives in processed_dir as
+            bfr_manifest.json and records, per source WAV: size, mtime,
+            content hash, the hash of the settings that shaped the
+            outputs and the artifacts we wrote.
+"""
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+
+MANIFEST_NAME = "bfr_manifest.json"
+MANIFEST_VERSION = 1
+# Settings that don't change what ends up in processed_dir
+RUN_ONLY_KEYS = ("target", "threads", "debug", "debug_dir", "tmp_dir",
+                 "wav_dir", "processed_dir", "wav_out", "scratch_root",
+                 "batch_size")
+HASH_BLOCK = 1 << 20
+# Seconds between manifest saves while a run is going
+SAVE_INTERVAL = 30
+
+
+def manifest_path(processed_dir):
+    """Where the manifest for processed_dir lives."""
+    return os.path.join(processed_dir, MANIFEST_NAME)
+
+
+def load_manifest(processed_dir):
+    """
+    Name:       load_manifest
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Returns the manifest dict, or an empty one if there is no
+                manifest yet or it can't be read.
+    """
+    empty = {"version": MANIFEST_VERSION, "files": {}}
+    try:
+        with open(manifest_path(processed_dir), 'r') as handle:
+            manifest = json.load(handle)
+    except FileNotFoundError:
+        return empty
+    except (OSError, ValueError) as e:
+        logging.warning('load_manifest(): Ignoring bad manifest in %s: %s',
+                        processed_dir, e)
+        return empty
+    if manifest.get("version") != MANIFEST_VERSION:
+        logging.info('load_manifest(): Manifest version changed, starting over')
+        return empty
+    return manifest
+
+
+def save_manifest(processed_dir, manifest):
+    """
+    Name:       save_manifest
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Writes to a temp file and renames so a killed run never
+                leaves a half written manifest behind.
+    """
+    out = manifest_path(processed_dir)
+    tmp_out = "%s.tmp" % out
+    with open(tmp_out, 'w') as handle:
+        json.dump(manifest, handle, indent=1, sort_keys=True)
+    os.replace(tmp_out, out)
+    logging.debug('save_manifest(): %d entries to %s',
+                  len(manifest["files"]), out)
+
+
+def settings_hash(settings):
+    """
+    Name:       settings_hash
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      sha1 over the settings that affect the outputs, so a
+                change to e.g. n_fft or the encode profile reprocesses
+                everything but a change of worker count does not.
+                Optional settings left at their default are skipped, so
+                adding a new one doesn't reprocess every target.
+    """
+    values = dataclasses.asdict(settings)
+    for key in RUN_ONLY_KEYS:
+        values.pop(key, None)
+    _drop_defaults(settings, values)
+    _drop_defaults(settings.taxa, values["taxa"])
+    blob = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+def _drop_defaults(obj, values):
+    """Pops obj's optional fields still at their default out of values."""
+    for field in dataclasses.fields(obj):
+        if (field.default is not dataclasses.MISSING and
+                values.get(field.name) == field.default):
+            values.pop(field.name)
+
+
+def content_hash(wav_file):
+    """sha1 of the file contents, read in 1 MB blocks."""
+    digest = hashlib.sha1()
+    with open(wav_file, 'rb') as handle:
+        for block in iter(lambda: handle.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def needs_processing(manifest, wav_file, config_hash):
+    """
+    Name:       needs_processing
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Returns (True/False, reason). Size+mtime are checked first
+                so unchanged files cost one stat(); we only hash the file
+                when the stat changed, so a touch doesn't reprocess.
+    """
+    entry = manifest["files"].get(wav_file)
+    if entry is None:
+        return True, "new"
+    if entry["config_hash"] != config_hash:
+        return True, "settings changed"
+    for artifact in entry["artifacts"]:
+        if not os.path.exists(artifact):
+            return True, "missing %s" % artifact
+    try:
+        stat = os.stat(wav_file)
+    except OSError:
+        return True, "unreadable"
+    if stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]:
+        return False, "unchanged"
+    if stat.st_size == entry["size"] and content_hash(wav_file) == entry["sha1"]:
+        # Touched but not changed; remember the new mtime
+        entry["mtime_ns"] = stat.st_mtime_ns
+        return False, "touched"
+    return True, "changed"
+
+
+def record_file(manifest, wav_file, config_hash, sha1, artifacts):
+    """
+    Name:       record_file
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Notes a successfully processed file. sha1 comes back from
+                the worker, which reads the file anyway.
+    """
+    stat = os.stat(wav_file)
+    manifest["files"][wav_file] = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha1": sha1,
+        "config_hash": config_hash,
+        "artifacts": sorted(artifacts),
+    }
+
+
+def filter_files(manifest, wav_files, config_hash):
+    """
+    Name:       filter_files
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Returns the wav_files that need (re)processing.
+    """
+    todo = []
+    reasons = {}
+    for wav_file in wav_files:
+        needed, reason = needs_processing(manifest, wav_file, config_hash)
+        key = reason.split(' ')[0]
+        reasons[key] = reasons.get(key, 0) + 1
+        if needed:
+            logging.debug('filter_files(): %s: %s', wav_file, reason)
+            todo.append(wav_file)
+    logging.info('filter_files(): %d of %d files to process %s', len(todo),
+                 len(wav_files), reasons)
+    return todo
@@ -0,0 +1,89 @@
+"""
+
+Author: robertdcurrier@gmail.com
+Created:    2026-10-18
+Modified:   2026-10-18
+Notes:      Peak memory per pipeline step. ru_maxrss only ever goes up,
+            so on Linux we reset the kernel's high-water mark (VmHWM)
+            through /proc/self/clear_refs before each step and read it
+            back after. Elsewhere we fall back to ru_maxrss, which then
+            reads as the peak so far rather than the step's own.
+            The per-step peaks tell us how many pool workers fit on a
+            node.
+"""
+import contextlib
+import logging
+import os
+import resource
+
+MB = 1024 * 1024
+
+
+def reset_peak():
+    """Resets this process's VmHWM. False if the kernel won't let us."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as handle:
+            handle.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """High-water RSS of this process in bytes since the last reset_peak."""
+    try:
+        with open('/proc/self/status', 'r') as handle:
+            for line in handle:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextlib.contextmanager
+def track_peak(step, peaks):
+    """
+    Name:       track_peak
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      with track_peak('spectrogram', peaks): ... records the
+                peak RSS of the block, in MB, as peaks[step]. Only
+                meaningful in a process that runs one step at a time.
+    """
+    reset_peak()
+    try:
+        yield
+    finally:
+        peaks[step] = peak_rss() / MB
+
+
+def node_memory():
+    """Physical memory on this node in bytes, 0 if we can't tell."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+def report_peaks(peaks, workers):
+    """
+    Name:       report_peaks
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Logs the worst peak per step over the run and how many
+                workers of that size fit in this node's memory.
+    """
+    if not peaks:
+        return
+    for step, peak in sorted(peaks.items(), key=lambda item: -item[1]):
+        logging.info('report_peaks(): %-12s peak %7.0f MB', step, peak)
+    worst = max(peaks.values())
+    total = node_memory()
+    if total and worst:
+        logging.info('report_peaks(): %0.0f MB per worker, room for %d on '
+                     'this node (running %d)', worst, int(total / MB // worst),
+                     workers)
@@ -166,15 +166,15 @@ def manual_update_record(collection, id, taxa, form):
 
 
 
-def build_raw_doc(config, args, wav_file):
+def build_raw_doc(settings, wav_file):
     """
     Create raw file document for insertion into MongoDB
-    This is the atomic data structure.
+    This is the atomic data structure. settings is the resolved
+    TargetSettings from bfr_settings.
     """
-    target = args['target']
-    processed_dir = config["targets"][target]["processed_dir"]
-    pi = config["targets"][target]["pi"]
-    project = config["targets"][target]["project"]
+    processed_dir = settings.processed_dir
+    pi = settings.pi
+    project = settings.project
     base = os.path.basename(wav_file)
     no_ext = os.path.splitext(base)[0]
     annotated_out = '%s/%s_annotated.png' % (processed_dir, no_ext)
@@ -0,0 +1,167 @@
+"""
+
+Author: robertdcurrier@gmail.com
+Created:    2026-10-18
+Modified:   2026-10-18
+Notes:      Per-deployment background noise model. Every recording from
+            a mooring carries the same persistent noise bands, and with
+            fixed thresholds the detector works through them file after
+            file. For targets with noise_model on, each file's per-band
+            noise floor comes back in its result record. The parent
+            keeps the last NOISE_HISTORY of them in
+            processed_dir/bfr_noise.json, one per file name so a
+            reprocessed file replaces its old floors, and the per-band
+            median over those is the background. Workers get the background as it
+            stood when the run started and subtract it from each
+            spectrogram before detection. The first run on a deployment
+            only seeds the model.
+            Floors are in dB re 1.0, taken before the top_db clip (see
+            bfr_dsp.amplitude_db). mel_spec_db is relative to each
+            file's loudest cell, so one loud call moves every band of
+            it by tens of dB, and with the clip most bands' medians are
+            just -top_db. file_background puts the background on a
+            file's own scale.
+"""
+import json
+import logging
+import os
+import numpy as np
+
+NOISE_NAME = "bfr_noise.json"
+NOISE_VERSION = 3
+# Files the background is the median over
+NOISE_HISTORY = 64
+# Settings that shape the mel dB matrix. Floors kept under other values,
+# or at another WAV rate, don't line up with ours and are dropped
+NOISE_KEYS = ("n_mels", "spec_fmin", "spec_fmax", "spec_power", "n_fft",
+              "hop_length", "analysis_mode", "fft_mode", "boost", "lowpass",
+              "highpass")
+
+
+def noise_path(processed_dir):
+    """Where the noise model for processed_dir lives."""
+    return os.path.join(processed_dir, NOISE_NAME)
+
+
+def noise_key(settings, rate):
+    """The NOISE_KEYS values of settings and the WAV rate, as a dict."""
+    key = {name: getattr(settings, name) for name in NOISE_KEYS}
+    key["rate"] = rate
+    return key
+
+
+def load_noise(processed_dir, settings, rate):
+    """
+    Name:       load_noise
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Returns the noise model dict for settings' target at WAV
+                rate rate, or an empty one if there is none yet, it
+                can't be read or it was built with different spectrogram
+                settings or rate.
+    """
+    empty = {"version": NOISE_VERSION, "key": noise_key(settings, rate),
+             "floors": {}}
+    try:
+        with open(noise_path(processed_dir), 'r') as handle:
+            model = json.load(handle)
+    except FileNotFoundError:
+        return empty
+    except (OSError, ValueError) as e:
+        logging.warning('load_noise(): Ignoring bad noise model in %s: %s',
+                        processed_dir, e)
+        return empty
+    if model.get("version") != NOISE_VERSION:
+        logging.info('load_noise(): Noise model version changed, starting over')
+        return empty
+    if model.get("key") != empty["key"]:
+        logging.info('load_noise(): Spectrogram settings changed, starting '
+                     'the noise model over')
+        return empty
+    return model
+
+
+def save_noise(processed_dir, model):
+    """
+    Name:       save_noise
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Temp file and rename, like save_manifest.
+    """
+    out = noise_path(processed_dir)
+    tmp_out = "%s.tmp" % out
+    with open(tmp_out, 'w') as handle:
+        json.dump(model, handle)
+    os.replace(tmp_out, out)
+    logging.debug('save_noise(): %d floors to %s', len(model["floors"]), out)
+
+
+def file_noise(rate, levels):
+    """What a result record carries under "noise": rate and floors."""
+    return {"rate": rate, "floor": levels["floor"].tolist()}
+
+
+def add_floor(model, file, noise):
+    """
+    Name:       add_floor
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Adds file's file_noise floors, keeping the last
+                NOISE_HISTORY files. Floors are keyed by file name, so
+                a file run again (-F, a new encode) moves to the newest
+                slot instead of counting twice. Files at another rate
+                than the model's are left out.
+    """
+    if noise["rate"] != model["key"]["rate"]:
+        logging.debug('add_floor(): %s Hz floors left out of a %s Hz model',
+                      noise["rate"], model["key"]["rate"])
+        return
+    floors = model["floors"]
+    name = os.path.basename(file)
+    floors.pop(name, None)
+    floors[name] = [round(value, 2) for value in noise["floor"]]
+    for oldest in list(floors)[:-NOISE_HISTORY]:
+        del floors[oldest]
+
+
+def background(model):
+    """
+    Name:       background
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      What workers get: the WAV rate and the per-band median
+                of the model's floors as a float32 array, or None while
+                it has none.
+    """
+    if not model["floors"]:
+        return None
+    floor = np.median(np.array(list(model["floors"].values()),
+                               dtype=np.float32), axis=0)
+    return {"rate": model["key"]["rate"], "floor": floor.astype(np.float32)}
+
+
+def file_background(background, rate, levels, mel_spec_db):
+    """
+    Name:       file_background
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      background moved onto mel_spec_db's scale with the file's
+                amplitude_db levels, for find_rois. Held up to the clip
+                floor, mel_spec_db's minimum, as the matrix can't show
+                anything quieter. None if there's no background or it
+                was built at another rate than this file's.
+    """
+    if background is None or background["rate"] != rate:
+        return None
+    return np.maximum(background["floor"] - levels["ref_db"],
+                      mel_spec_db.min())
+
+
+def subtract_background(mel_spec_db, floor):
+    """mel_spec_db with each band's floor taken off, in one go."""
+    return mel_spec_db - floor[:, None]
@@ -0,0 +1,86 @@
+"""
+
+Author: robertdcurrier@gmail.com
+Created:    2026-10-18
+Modified:   2026-10-18
+Notes:      Draws the raw mel PNGs straight from the dB matrix. No
+            matplotlib figure, no 1000 dpi savefig, no read back and
+            resize. The annotated PNG still goes through matplotlib as
+            it needs axes, ticks and the colorbar.
+"""
+import functools
+import numpy as np
+import cv2 as cv2
+import matplotlib
+from matplotlib import cm
+
+# matplotlib colormaps are 256 entry tables
+LUT_SIZE = 256
+
+
+@functools.lru_cache(maxsize=None)
+def cmap_lut(cmap):
+    """
+    Name:       cmap_lut
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Builds a (256, 3) uint8 BGR lookup table for a matplotlib
+                colormap name. Cached, so we only pay for it once per
+                process.
+    """
+    try:
+        colormap = matplotlib.colormaps[cmap]
+    except AttributeError:
+        # matplotlib < 3.5
+        colormap = cm.get_cmap(cmap)
+    rgba = colormap(np.arange(LUT_SIZE))
+    lut = np.rint(rgba[:, 2::-1] * 255).astype(np.uint8)
+    return lut
+
+
+@functools.lru_cache(maxsize=None)
+def header_image(header, header_x, frame_y):
+    """
+    Name:       header_image
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      The header PNG decoded and resized to header_x x frame_y.
+                header_footer used to imread it for every file; now each
+                process reads it once. None if it can't be read.
+    """
+    image = cv2.imread(header)
+    if image is None:
+        return None
+    image = cv2.resize(image, (header_x, frame_y))
+    image.flags.writeable = False
+    return image
+
+
+def render_mel(mel_spec_db, cmap, frame_x, frame_y):
+    """
+    Name:       render_mel
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Turns the dB matrix into a frame_x x frame_y BGR image the
+                way specshow would draw it: min/max normalized, low mel
+                bins at the BOTTOM. We resize the normalized values and
+                then apply the LUT so we only color frame_x*frame_y
+                pixels and don't smear colors from the gist_ncar map.
+    """
+    db = np.asarray(mel_spec_db, dtype=np.float32)
+    lo = db.min()
+    hi = db.max()
+    if hi > lo:
+        norm = db - lo
+        norm *= np.float32(1 / (hi - lo))
+    else:
+        norm = np.zeros_like(db)
+    # mel axis runs up the image like specshow(y_axis='mel')
+    norm = np.ascontiguousarray(norm[::-1])
+    norm = cv2.resize(norm, (frame_x, frame_y), interpolation=cv2.INTER_AREA)
+    # Same binning matplotlib's Normalize -> Colormap does
+    idx = np.clip(norm * LUT_SIZE, 0, LUT_SIZE - 1).astype(np.uint8)
+    return cmap_lut(cmap)[idx]
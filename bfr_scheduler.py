@@ -0,0 +1,237 @@
+"""
+
+Author: robertdcurrier@gmail.com
+Created:    2026-10-18
+Modified:   2026-10-18
+Notes:      Staged pipeline for bfr(). Instead of one pool running every
+            step of a file back to back, each stage (decode, spectrogram,
+            render, encode, persist) gets its own process or thread pool
+            and a bounded queue in front of it. A worker waiting on ffmpeg
+            no longer holds a core the STFT could use, and the queue
+            bounds keep a fast stage from piling up samples in memory.
+            At the end we log, per stage, busy time as a share of its
+            workers and the time-averaged and peak queue depth, so the
+            bottleneck is the stage with a full queue and ~100% busy.
+"""
+import collections
+import concurrent.futures as futures
+import logging
+import time
+from dataclasses import dataclass
+# Local imports
+from bfr_memory import track_peak
+from bfr_scratch import remove_dir
+
+STAGE_KINDS = ("process", "thread")
+# Pool tasks a do_singles worker runs before it is replaced, so whatever
+# leaks in librosa/matplotlib/cv2 is handed back to the OS now and then
+MAX_TASKS_PER_CHILD = 50
+# Upper bound on files per pool task, so progress stays live
+CHUNK_MAX = 4
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    Name:       Stage
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      One pipeline stage. func(job, *args) takes and returns a
+                job dict. depth bounds the queue in front of the stage;
+                0 means twice the workers.
+    """
+    name: str
+    func: object
+    kind: str
+    workers: int
+    depth: int = 0
+    args: tuple = ()
+    initializer: object = None
+    initargs: tuple = ()
+
+
+def parse_stage_workers(spec):
+    """'spectrogram:6,encode:2' -> {'spectrogram': 6, 'encode': 2}"""
+    workers = {}
+    if not spec:
+        return workers
+    for part in spec.split(','):
+        name, _, count = part.partition(':')
+        try:
+            workers[name.strip()] = max(1, int(count))
+        except ValueError:
+            raise ValueError("Bad stage worker count %r" % part)
+    return workers
+
+
+def pool_chunksize(num_files, workers):
+    """
+    Name:       pool_chunksize
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Files per imap_unordered task. Aims for four tasks per
+                worker so the tail of the run stays short, capped at
+                CHUNK_MAX so results stream back steadily and a recycled
+                worker doesn't take a big chunk with it.
+    """
+    return max(1, min(CHUNK_MAX, num_files // (4 * max(1, workers))))
+
+
+def log_progress(done, failed, total, start_time):
+    """Running count, files/min and time left, one line per result."""
+    elapsed = max(time.time() - start_time, 1e-6)
+    rate = 60 * done / elapsed
+    left = (total - done) / rate if rate else 0
+    logging.info('progress: %d/%d files (%d failed), %0.1f files/min, '
+                 '%0.1f min left', done, total, failed, rate, left)
+
+
+def _timed(name, func, job, track_memory, *args):
+    """
+    Runs func in the worker and notes how long it was busy and, in
+    process stages, the worker's peak RSS. Thread stages share the
+    parent's memory with everything else, so theirs would mean nothing.
+    """
+    timings = job.get("timings", {})
+    peaks = job.get("peaks", {})
+    start_time = time.perf_counter()
+    if track_memory:
+        with track_peak(name, peaks):
+            job = func(job, *args)
+    else:
+        job = func(job, *args)
+    elapsed = time.perf_counter() - start_time
+    timings[name] = elapsed
+    job["timings"] = timings
+    if peaks:
+        job["peaks"] = peaks
+    return job, elapsed
+
+
+def _failed(stage, job, e):
+    """
+    Failed result record for job, which stage couldn't run. The job's
+    scratch dir, if it has one yet, goes now rather than at the end of
+    the run.
+    """
+    logging.warning('run_stages(): %s failed for %s: %s', stage.name,
+                    job["file"], e)
+    if job.get("tmp_dir"):
+        remove_dir(job["tmp_dir"])
+    return {"file": job["file"], "ok": False,
+            "error": "%s: %s" % (stage.name, e)}
+
+
+def _make_executor(stage):
+    """Pool for stage."""
+    if stage.kind == "process":
+        return futures.ProcessPoolExecutor(stage.workers,
+                                           initializer=stage.initializer,
+                                           initargs=stage.initargs)
+    return futures.ThreadPoolExecutor(stage.workers,
+                                      thread_name_prefix=stage.name,
+                                      initializer=stage.initializer,
+                                      initargs=stage.initargs)
+
+
+def run_stages(jobs, stages):
+    """
+    Name:       run_stages
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Pushes each job dict (which must carry "file") through
+                stages in order and yields what the last stage returned
+                as each job completes, with per-stage seconds under
+                "timings" and process stages' peak RSS in MB under
+                "peaks". A stage only starts a job when the next stage's
+                queue has room for the result. A job that raises is
+                dropped with an {"file", "ok": False, "error"} record in
+                place of its result, and its "tmp_dir" removed. So is
+                one a stage can't take because a worker died and broke
+                its process pool; the stage gets a fresh pool for the
+                jobs after it.
+    """
+    for stage in stages:
+        if stage.kind not in STAGE_KINDS:
+            raise ValueError("%s: kind must be one of %s" %
+                             (stage.name, ", ".join(STAGE_KINDS)))
+    depths = [stage.depth or 2 * stage.workers for stage in stages]
+    queues = [collections.deque() for _ in stages]
+    running = [0] * len(stages)
+    busy = [0.0] * len(stages)
+    done = [0] * len(stages)
+    depth_area = [0.0] * len(stages)
+    depth_max = [0] * len(stages)
+    in_flight = {}
+    source = iter(jobs)
+    source_done = False
+    executors = []
+    wall_start = time.time()
+    last_time = wall_start
+    try:
+        for stage in stages:
+            executors.append(_make_executor(stage))
+        while True:
+            # Top up the first queue, then start whatever has room to
+            # finish, last stage first so results drain before new work
+            while not source_done and len(queues[0]) < depths[0]:
+                try:
+                    queues[0].append(next(source))
+                except StopIteration:
+                    source_done = True
+            for index in reversed(range(len(stages))):
+                stage = stages[index]
+                while queues[index] and running[index] < stage.workers:
+                    if (index + 1 < len(stages) and len(queues[index + 1]) +
+                            running[index] >= depths[index + 1]):
+                        break
+                    job = queues[index].popleft()
+                    try:
+                        future = executors[index].submit(
+                            _timed, stage.name, stage.func, job,
+                            stage.kind == "process", *stage.args)
+                    except futures.BrokenExecutor as e:
+                        yield _failed(stage, job, e)
+                        executors[index].shutdown(wait=False,
+                                                  cancel_futures=True)
+                        executors[index] = _make_executor(stage)
+                        continue
+                    in_flight[future] = (index, job)
+                    running[index] += 1
+            if not in_flight:
+                break
+            finished, _ = futures.wait(in_flight,
+                                       return_when=futures.FIRST_COMPLETED)
+            now = time.time()
+            for index, queue in enumerate(queues):
+                depth_area[index] += len(queue) * (now - last_time)
+                depth_max[index] = max(depth_max[index], len(queue))
+            last_time = now
+            for future in finished:
+                index, job = in_flight.pop(future)
+                running[index] -= 1
+                try:
+                    job, elapsed = future.result()
+                except Exception as e:
+                    yield _failed(stages[index], job, e)
+                    continue
+                busy[index] += elapsed
+                done[index] += 1
+                if index + 1 < len(stages):
+                    queues[index + 1].append(job)
+                else:
+                    yield job
+    finally:
+        for executor in executors:
+            executor.shutdown(wait=True, cancel_futures=True)
+    wall = max(time.time() - wall_start, 1e-6)
+    for index, stage in enumerate(stages):
+        logging.info('run_stages(): %-12s %2d %s workers, %4d done, '
+                     '%3.0f%% busy, queue avg %0.1f max %d/%d', stage.name,
+                     stage.workers, stage.kind, done[index],
+                     100 * busy[index] / (wall * stage.workers),
+                     depth_area[index] / wall, depth_max[index],
+                     depths[index])
@@ -0,0 +1,71 @@
+"""
+
+Author: robertdcurrier@gmail.com
+Created:    2026-10-18
+Modified:   2026-10-18
+Notes:      Scratch space for intermediates. Replaces the shared tmp/ dir
+            that clean_tmp_files() wiped at start and end, which meant
+            two targets couldn't run on one host at the same time. Each
+            run gets its own dir, each worker a subdir of that and each
+            file a subdir of the worker's that goes away when the file
+            is done. Defaults to /dev/shm when there's room.
+"""
+import logging
+import os
+import shutil
+import tempfile
+
+SHM_ROOT = "/dev/shm"
+# Rough high-water mark per worker: filtered WAV + mel PNG for one file
+SCRATCH_PER_WORKER = 64 * 1024 * 1024
+
+
+def pick_scratch_root(preferred, workers):
+    """
+    Name:       pick_scratch_root
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      preferred (scratch_root in the config or -s) wins. If it
+                is empty we use /dev/shm when it can hold every worker's
+                scratch, else the system temp dir.
+    """
+    if preferred:
+        return preferred
+    need = workers * SCRATCH_PER_WORKER
+    try:
+        if shutil.disk_usage(SHM_ROOT).free > need:
+            return SHM_ROOT
+        logging.info('pick_scratch_root(): Not enough room in %s, using %s',
+                     SHM_ROOT, tempfile.gettempdir())
+    except OSError:
+        pass
+    return tempfile.gettempdir()
+
+
+def make_run_dir(root, target):
+    """Private scratch dir for this run under root."""
+    os.makedirs(root, exist_ok=True)
+    run_dir = tempfile.mkdtemp(prefix="bfr_%s_" % target, dir=root)
+    logging.info('make_run_dir(): Scratch in %s', run_dir)
+    return run_dir
+
+
+def make_worker_dir(run_dir):
+    """Subdir of run_dir for the calling pool worker."""
+    worker_dir = os.path.join(run_dir, "w%d" % os.getpid())
+    os.makedirs(worker_dir, exist_ok=True)
+    return worker_dir
+
+
+def make_file_dir(worker_dir, no_ext):
+    """Subdir of worker_dir for one recording."""
+    file_dir = os.path.join(worker_dir, no_ext)
+    os.makedirs(file_dir, exist_ok=True)
+    return file_dir
+
+
+def remove_dir(scratch_dir):
+    """Removes a run, worker or file scratch dir and everything in it."""
+    shutil.rmtree(scratch_dir, ignore_errors=True)
+    logging.debug('remove_dir(): Removed %s', scratch_dir)
@@ -0,0 +1,272 @@
+"""
+
+Author: robertdcurrier@gmail.com
+Created:    2026-10-18
+Modified:   2026-10-18
+Notes:      Resolved, read-only settings for one target. bfr() builds
+            this once, checks it before the batch starts and ships it to
+            the pool workers, so nothing downstream re-reads the config
+            or re-runs argparse.
+"""
+import logging
+from dataclasses import dataclass, fields, MISSING
+
+ANALYSIS_MODES = ("full", "decimated")
+# exact runs the FFT at n_fft, fast pads it to scipy's next_fast_len,
+# which changes the spectrogram and ROIs (see bfr_dsp.analysis_plan)
+FFT_MODES = ("exact", "fast")
+# x264 settings for the MP4 stage. archive is what ffmpeg_it always used.
+# tune/gop of None leaves the x264 default in place.
+ENCODE_PROFILES = {
+    "archive": {"preset": "veryslow", "crf": 20, "tune": None,
+                "gop": None, "threads": 0},
+    "balanced": {"preset": "medium", "crf": 22, "tune": "animation",
+                 "gop": 240, "threads": 0},
+    "preview": {"preset": "veryfast", "crf": 28, "tune": "fastdecode",
+                "gop": 48, "threads": 0},
+}
+# coral: Canny/contours on the rendered PNG. db: thresholds the mel dB
+# matrix against each band's noise floor, see seek_biologics_db
+DETECTORS = ("coral", "db")
+# Old key names still found in some targets -> current key names
+TAXA_ALIASES = {
+    "min_roi": "min_roi_area",
+    "max_roi": "max_roi_area",
+}
+
+
+@dataclass(frozen=True)
+class TaxaSettings:
+    """
+    Name:       TaxaSettings
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      CORAL detection settings for one taxa block.
+    """
+    min_roi_area: int
+    max_roi_area: int
+    min_roi_w: int
+    max_roi_w: int
+    min_roi_h: int
+    max_roi_h: int
+    rect_color: tuple
+    edge_color: str
+    line_thick: int
+    radius_boost: int
+    con_edges_min: int
+    con_edges_max: int
+    coral_edges_min: int
+    coral_edges_max: int
+    thresh_min: int
+    thresh_max: int
+    # Merge ROIs overlapping by at least this IoU; 0 only drops repeats
+    merge_iou: float = 0.0
+    detector: str = "coral"
+    # db detector: dB above a band's noise floor that counts as signal,
+    # and the shortest / narrowest region that counts as an ROI
+    db_thresh: float = 10.0
+    db_min_seconds: float = 0.1
+    db_min_hz: float = 0.0
+
+
+@dataclass(frozen=True)
+class TargetSettings:
+    """
+    Name:       TargetSettings
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Everything the pipeline needs for one target. Only the
+                keys we actually use are carried.
+    """
+    target: str
+    pi: str
+    project: str
+    debug: bool
+    taxa: TaxaSettings
+    wav_dir: str
+    processed_dir: str
+    debug_dir: str
+    tmp_dir: str
+    wav_out: str
+    hop_length: int
+    spec_fmin: int
+    spec_fmax: int
+    spec_power: float
+    spec_fsteps: int
+    n_fft: int
+    n_mels: int
+    cmap: str
+    fps: int
+    header: str
+    footer: str
+    header_x: int
+    footer_x: int
+    annotated_x: int
+    annotated_y: int
+    frame_x: int
+    frame_y: int
+    fig_x: float
+    fig_y: float
+    dpi: int
+    boost: float
+    lowpass: int
+    highpass: int
+    recording_seconds: float
+    analysis_mode: str = "full"
+    fft_mode: str = "exact"
+    encode_profile: str = "archive"
+    # Threads per pool worker from bfr_threads.plan_budget; 0 = no limit
+    threads: int = 0
+    # Where run scratch dirs go; empty picks /dev/shm or the temp dir
+    scratch_root: str = ""
+    # Files per pool task through the batched STFT in bfr_stft; 1 = off
+    batch_size: int = 1
+    # Subtract the deployment's background noise before detection; see
+    # bfr_noise
+    noise_model: bool = False
+
+
+def _required(cls):
+    """Names of the fields on cls that have no default."""
+    return [field.name for field in fields(cls) if field.default is MISSING]
+
+
+def _optional(cls):
+    """Fields on cls that have a default, as a name -> default dict."""
+    return {field.name: field.default for field in fields(cls)
+            if field.default is not MISSING}
+
+
+def _parse_color(color):
+    """'0,0,255' -> (0, 0, 255). Used to be eval()ed in seek_biologics."""
+    return tuple(int(part) for part in str(color).split(','))
+
+
+def _check_numbers(block, names, where, errors):
+    """Flags keys in names that aren't plain numbers."""
+    for name in names:
+        value = block.get(name)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            errors.append("%s: %s should be a number, got %r" %
+                          (where, name, value))
+
+
+def load_taxa_settings(taxa_block, where, errors):
+    """
+    Name:       load_taxa_settings
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Builds TaxaSettings from one taxa block. Problems are
+                appended to errors so we can report them all at once.
+    """
+    block = dict(taxa_block)
+    for old, new in TAXA_ALIASES.items():
+        if old in block and new not in block:
+            logging.warning('load_taxa_settings(): %s uses old key %s, '
+                            'please rename to %s', where, old, new)
+            block[new] = block.pop(old)
+    missing = [name for name in _required(TaxaSettings) if name not in block]
+    if missing:
+        errors.append("%s: missing %s" % (where, ", ".join(missing)))
+        return None
+    numbers = [name for name in _required(TaxaSettings)
+               if name not in ("rect_color", "edge_color")]
+    bad = len(errors)
+    _check_numbers(block, numbers, where, errors)
+    if len(errors) > bad:
+        return None
+    try:
+        rect_color = _parse_color(block["rect_color"])
+    except ValueError:
+        errors.append("%s: rect_color %r is not B,G,R" %
+                      (where, block["rect_color"]))
+        return None
+    for low, high in (("min_roi_area", "max_roi_area"),
+                      ("min_roi_w", "max_roi_w"),
+                      ("min_roi_h", "max_roi_h")):
+        if block[low] >= block[high]:
+            errors.append("%s: %s must be below %s" % (where, low, high))
+    values = {name: block[name] for name in _required(TaxaSettings)}
+    values["rect_color"] = rect_color
+    for name, default in _optional(TaxaSettings).items():
+        values[name] = block.get(name, default)
+    _check_numbers(values, ["merge_iou", "db_thresh", "db_min_seconds",
+                            "db_min_hz"], where, errors)
+    if len(errors) > bad:
+        return None
+    if not 0 <= values["merge_iou"] <= 1:
+        errors.append("%s: merge_iou must be between 0 and 1" % where)
+    if values["detector"] not in DETECTORS:
+        errors.append("%s: detector must be one of %s" %
+                      (where, ", ".join(DETECTORS)))
+    for name in ("db_thresh", "db_min_seconds", "db_min_hz"):
+        if values[name] < 0:
+            errors.append("%s: %s can't be negative" % (where, name))
+    return TaxaSettings(**values)
+
+
+def load_settings(config, target, taxa="beta", **overrides):
+    """
+    Name:       load_settings
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Resolves and validates settings for target. overrides are
+                CLI values that win over the config file. Raises
+                ValueError listing every problem found, so schema drift
+                shows up before a multi-hour batch, not halfway through.
+    """
+    try:
+        block = dict(config['targets'][target])
+    except KeyError:
+        raise ValueError("Invalid target %s" % target)
+    errors = []
+    block.update({key: value for key, value in overrides.items()
+                  if value is not None})
+    taxa_block = block.get('taxa', {}).get(taxa)
+    if taxa_block is None:
+        errors.append("%s: no taxa block '%s'" % (target, taxa))
+        taxa_settings = None
+    else:
+        taxa_settings = load_taxa_settings(taxa_block, "%s/%s" %
+                                           (target, taxa), errors)
+    names = [name for name in _required(TargetSettings)
+             if name not in ("target", "taxa")]
+    missing = [name for name in names if name not in block]
+    if missing:
+        errors.append("%s: missing %s" % (target, ", ".join(missing)))
+    else:
+        _check_numbers(block, ["hop_length", "spec_fmin", "spec_fmax",
+                               "spec_power", "n_fft", "n_mels", "fps",
+                               "frame_x", "frame_y", "boost", "lowpass",
+                               "highpass", "recording_seconds"],
+                       target, errors)
+        if not errors and block["spec_fmin"] >= block["spec_fmax"]:
+            errors.append("%s: spec_fmin must be below spec_fmax" % target)
+    analysis_mode = block.get("analysis_mode", "full")
+    if analysis_mode not in ANALYSIS_MODES:
+        errors.append("%s: analysis_mode must be one of %s" %
+                      (target, ", ".join(ANALYSIS_MODES)))
+    fft_mode = block.get("fft_mode", "exact")
+    if fft_mode not in FFT_MODES:
+        errors.append("%s: fft_mode must be one of %s" %
+                      (target, ", ".join(FFT_MODES)))
+    encode_profile = block.get("encode_profile", "archive")
+    if encode_profile not in ENCODE_PROFILES:
+        errors.append("%s: encode_profile must be one of %s" %
+                      (target, ", ".join(ENCODE_PROFILES)))
+    batch_size = block.get("batch_size", 1)
+    if isinstance(batch_size, bool) or not isinstance(batch_size, int) \
+            or batch_size < 1:
+        errors.append("%s: batch_size must be a whole number >= 1" % target)
+    if not isinstance(block.get("noise_model", False), bool):
+        errors.append("%s: noise_model must be true or false" % target)
+    if errors:
+        raise ValueError("; ".join(errors))
+    values = {name: block[name] for name in names}
+    for name, default in _optional(TargetSettings).items():
+        values[name] = block.get(name, default)
+    return TargetSettings(target=target, taxa=taxa_settings, **values)
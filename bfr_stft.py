@@ -0,0 +1,79 @@
+"""
+
+Author: robertdcurrier@gmail.com
+Created:    2026-10-18
+Modified:   2026-10-18
+Notes:      Batched STFT + mel projection. Our deployments write
+            thousands of fixed-length recordings with identical analysis
+            settings, so rather than one librosa.stft per file we stack N
+            recordings into an (N, samples) float32 array, frame them
+            with strides (no copy), window and rfft every frame of every
+            file in one scipy.fft call and project the band the mel
+            filters use in one matmul. Padding and centering follow
+            librosa.stft, so the output matches mel_power per file.
+"""
+import logging
+import numpy as np
+import scipy.fft
+from numpy.lib.stride_tricks import sliding_window_view
+# Local imports
+from bfr_dsp import mel_bank, band_power, pad_mode, frame_count
+
+# Working set we allow one mel_batch call: windowed frames + spectrum
+STFT_BATCH_BYTES = 256 * 1024 * 1024
+
+
+def batch_limit(samples, n_fft, hop_length, limit=STFT_BATCH_BYTES,
+                fft_len=None):
+    """
+    Name:       batch_limit
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      How many recordings of samples samples fit in one
+                mel_batch call without going over limit bytes. Counts the
+                float32 windowed frames, their fft_len padded copy and
+                the complex64 spectrum, which dominate. Never less than
+                one.
+    """
+    fft_len = fft_len or n_fft
+    frames = frame_count(samples, fft_len, hop_length)
+    per_file = frames * (n_fft * 4 + fft_len * 4 + (fft_len // 2 + 1) * 8)
+    return max(1, int(limit // per_file))
+
+
+def mel_batch(batch, rate, n_fft, hop_length, n_mels, fmin, fmax, power,
+              window='hann', workers=-1, fft_len=None):
+    """
+    Name:       mel_batch
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      (N, samples) float32 -> (N, n_mels, frames) mel power.
+                Same as mel_power on each row. workers is handed to
+                scipy.fft; -1 is every core, so callers inside a pool
+                should pass their thread share. fft_len zero pads each
+                windowed n_fft frame, see analysis_plan.
+    """
+    fft_len = fft_len or n_fft
+    basis, lo, hi, values = mel_bank(rate, n_fft, n_mels, fmin, fmax, window,
+                                     fft_len)
+    batch = np.asarray(batch, dtype=np.float32)
+    # librosa centers fft_len frames on t * hop_length and the n_fft
+    # window in the middle of each; start our n_fft frames where that
+    # window starts so odd sizes line up too
+    lead = fft_len // 2 - (fft_len - n_fft) // 2
+    count = frame_count(batch.shape[1], fft_len, hop_length)
+    tail = max(0, (count - 1) * hop_length + n_fft - batch.shape[1] - lead)
+    padded = np.pad(batch, ((0, 0), (lead, tail)), mode=pad_mode())
+    # (N, frames, n_fft) view onto padded; the window multiply makes the copy
+    frames = sliding_window_view(padded, n_fft, axis=-1)[:, ::hop_length]
+    frames = frames[:, :count]
+    spec = scipy.fft.rfft(frames * values, n=fft_len, axis=-1,
+                          workers=workers)
+    spec = np.abs(spec[..., lo:hi])
+    band_power(spec, power)
+    logging.debug('mel_batch(): %d x %d frames, bins %d:%d', batch.shape[0],
+                  frames.shape[1], lo, hi)
+    # (n_mels, band) @ (N, band, frames)
+    return np.matmul(basis, spec.transpose(0, 2, 1))
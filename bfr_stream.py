@@ -0,0 +1,357 @@
+"""
+
+Author: robertdcurrier@gmail.com
+Created:    2026-10-18
+Modified:   2026-10-18
+Notes:      Streaming mel spectrogram for recordings too long to hold in
+            RAM: hour long instrument files and the aggregate WAV
+            combine_wav builds. We read STREAM_BLOCK_SECONDS at a time
+            (WavReader, or soundfile for what it can't map) and carry
+            state through each step of the
+            one-shot chain: boost/clip, the Butterworth sections (sosfilt
+            zi), the resample (soxr's stream API, the same resampler
+            librosa.resample uses) or the decimating FIR, and the
+            center padded STFT, which goes through bfr_dsp.mel_block in
+            the same fixed frame blocks mel_power uses. The mel frames
+            come out bit for bit what mel_db gives on the whole file,
+            and what we hold is a block of samples plus one STFT block,
+            however long the recording. write_stream does the same for
+            the boosted WAV ffmpeg muxes in.
+"""
+import functools
+import inspect
+import logging
+import numpy as np
+import librosa
+import soundfile
+from scipy.signal import firwin, sosfilt, upfirdn
+# Local imports
+from bfr_dsp import (analysis_plan, filter_sections, mel_bank, mel_block,
+                     block_frames, frame_count, pad_mode, amplitude_db)
+from bfr_wav import WavReader, WavWriter, wav_info
+
+# Seconds of input audio read per block
+STREAM_BLOCK_SECONDS = 10
+# Files longer than this go through mel_db_stream in process_file
+STREAM_SECONDS = 600
+
+
+@functools.lru_cache(maxsize=None)
+def resample_type():
+    """librosa.resample's default res_type; soxr_hq since 0.10."""
+    return inspect.signature(librosa.resample).parameters['res_type'].default
+
+
+class Filter:
+    """
+    Name:       Filter
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      bfr_dsp.boost_filter a block at a time. Each section
+                keeps its sosfilt state between blocks.
+    """
+    def __init__(self, rate, boost, lowpass, highpass):
+        self.gain = np.float32(10 ** (boost / 20)) if boost else None
+        self.sections = filter_sections(rate, lowpass, highpass)
+        self.state = [np.zeros((sos.shape[0], 2)) for sos in self.sections]
+
+    def feed(self, bits):
+        """Filtered float32 copy of the next block."""
+        if self.gain is not None:
+            bits = np.multiply(bits, self.gain)
+            np.clip(bits, -1.0, 1.0, out=bits)
+        for index, sos in enumerate(self.sections):
+            bits, self.state[index] = sosfilt(sos, bits,
+                                              zi=self.state[index])
+            bits = bits.astype(np.float32)
+        return bits
+
+
+class Resampler:
+    """
+    Name:       Resampler
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      bfr_dsp.resample_audio a block at a time, through soxr's
+                ResampleStream. total is the input length, so we can pad
+                or trim the output to ceil(total * ratio) the way
+                librosa.resample does.
+    """
+    def __init__(self, rate, target_rate, total):
+        import soxr
+        res_type = resample_type()
+        if not res_type.startswith('soxr'):
+            logging.warning('Resampler(): librosa resamples with %s, '
+                            'streaming with soxr_hq won\'t match it', res_type)
+            res_type = 'soxr_hq'
+        self.stream = soxr.ResampleStream(rate, target_rate, 1,
+                                          dtype='float32', quality=res_type)
+        self.left = int(np.ceil(total * float(target_rate) / rate))
+
+    def feed(self, bits, last=False):
+        bits = self.stream.resample_chunk(bits, last=last)[:self.left]
+        if last and len(bits) < self.left:
+            bits = np.pad(bits, (0, self.left - len(bits)))
+        self.left -= len(bits)
+        return bits
+
+
+class Decimator:
+    """
+    Name:       Decimator
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      resample_poly(bits, 1, q) a block at a time. Same Kaiser
+                FIR, in float32, and the same pre padding, so output i
+                is sum(h[k] * x[(i + skip) * q - k]). Each call runs
+                upfirdn over the samples those outputs reach back to,
+                starting on a multiple of q.
+    """
+    def __init__(self, q, total):
+        half_len = 10 * q
+        taps = firwin(2 * half_len + 1, 1. / q, window=('kaiser', 5.0))
+        pre_pad = q - half_len % q
+        self.taps = np.concatenate((np.zeros(pre_pad, dtype=np.float32),
+                                    taps.astype(np.float32)))
+        self.q = q
+        self.skip = (half_len + pre_pad) // q
+        # Outputs a call reaches back over, in units of q input samples
+        self.reach = -(-(len(self.taps) - 1) // q)
+        self.total = total // q + bool(total % q)
+        self.done = 0
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.offset = 0
+
+    def feed(self, bits, last=False):
+        q = self.q
+        self.buffer = np.concatenate((self.buffer, bits))
+        end = self.offset + len(self.buffer)
+        if last:
+            stop = self.total
+        else:
+            # Output i needs input up to (i + skip) * q
+            stop = min(self.total, (end - 1) // q - self.skip + 1)
+        if stop <= self.done:
+            return np.zeros(0, dtype=np.float32)
+        start = (self.done + self.skip - self.reach) * q
+        segment = self.buffer[max(0, start - self.offset):]
+        if start < self.offset:
+            segment = np.concatenate((np.zeros(self.offset - start,
+                                               dtype=np.float32), segment))
+        if last:
+            # Zeros past the end, as upfirdn gives the whole file
+            segment = np.concatenate((segment, np.zeros(len(self.taps),
+                                                        dtype=np.float32)))
+        out = upfirdn(self.taps, segment, 1, q)
+        out = out[self.reach:self.reach + stop - self.done]
+        self.done = stop
+        # Keep what the next output reaches back to
+        keep = (self.done + self.skip - self.reach) * q
+        if keep > self.offset:
+            self.buffer = self.buffer[keep - self.offset:]
+            self.offset = keep
+        return out.astype(np.float32, copy=False)
+
+
+def stream_plan(wav_file, settings):
+    """
+    Name:       stream_plan
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      analysis_plan for wav_file from its header, plus the
+                input rate and length and the number of samples and
+                STFT frames at the analysis rate.
+    """
+    rate, frames = audio_info(wav_file)
+    plan = analysis_plan(rate, settings.spec_fmax, settings.n_fft,
+                         settings.hop_length, settings.analysis_mode,
+                         settings.fft_mode)
+    samples = frames
+    if plan["q"] == 0 and plan["rate"] != rate:
+        samples = int(np.ceil(frames * float(plan["rate"]) / rate))
+    elif plan["q"] == 0:
+        # resample_audio leaves SPEC_RATE files alone
+        plan["q"] = 1
+    if plan["q"] > 1:
+        samples = frames // plan["q"] + bool(frames % plan["q"])
+    plan.update(in_rate=rate, in_samples=frames,
+                samples=samples,
+                frames=frame_count(samples, plan["fft_len"],
+                                   plan["hop_length"]))
+    return plan
+
+
+def audio_info(wav_file):
+    """(rate, frames) of wav_file from its header."""
+    info = wav_info(wav_file)
+    if info is None:
+        info = soundfile.info(wav_file)
+        info = info.samplerate, info.frames
+    return info
+
+
+def read_blocks(wav_file, block_seconds=STREAM_BLOCK_SECONDS):
+    """Mono float32 blocks of wav_file, mixed down as librosa.load does."""
+    try:
+        wav = WavReader(wav_file)
+    except ValueError:
+        wav = None
+    if wav is not None:
+        with wav:
+            yield from wav.blocks(int(wav.rate * block_seconds))
+        return
+    with soundfile.SoundFile(wav_file) as handle:
+        size = int(handle.samplerate * block_seconds)
+        for block in handle.blocks(size, dtype='float32', always_2d=True):
+            if block.shape[1] == 1:
+                yield block[:, 0]
+            else:
+                yield np.mean(block.T, axis=-2)
+
+
+def analysis_blocks(wav_file, settings, plan,
+                    block_seconds=STREAM_BLOCK_SECONDS):
+    """
+    Name:       analysis_blocks
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      decode_file + prepare_analysis a block at a time: yields
+                float32 samples at plan["rate"], boosted and filtered.
+    """
+    dsp = Filter(plan["in_rate"], settings.boost, int(settings.lowpass),
+                 int(settings.highpass))
+    if plan["q"] > 1:
+        resampler = Decimator(plan["q"], plan["in_samples"])
+    elif plan["q"] == 0:
+        resampler = Resampler(plan["in_rate"], plan["rate"],
+                              plan["in_samples"])
+    else:
+        resampler = None
+    for block in read_blocks(wav_file, block_seconds):
+        block = dsp.feed(block)
+        yield resampler.feed(block) if resampler else block
+    if resampler:
+        yield resampler.feed(np.zeros(0, dtype=np.float32), last=True)
+
+
+def mel_stream(wav_file, settings, plan=None,
+               block_seconds=STREAM_BLOCK_SECONDS):
+    """
+    Name:       mel_stream
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Generator of (n_mels, k) float32 mel power blocks for
+                wav_file, in order, plan["frames"] frames in all. The
+                samples are center padded as librosa.stft would and cut
+                into the same frame blocks mel_power uses, so the
+                blocks concatenate to mel_power on the decoded file.
+    """
+    plan = plan or stream_plan(wav_file, settings)
+    fft_len = plan["fft_len"]
+    hop_length = plan["hop_length"]
+    half = fft_len // 2
+    count = plan["frames"]
+    bank = mel_bank(plan["rate"], plan["n_fft"], settings.n_mels,
+                    settings.spec_fmin, settings.spec_fmax, 'hann', fft_len)
+    block = block_frames(fft_len)
+    # buffer holds the padded signal from padded index offset on
+    buffer = np.zeros(0, dtype=np.float32)
+    offset = 0
+    padded_head = False
+    start = 0
+    blocks = analysis_blocks(wav_file, settings, plan, block_seconds)
+    source_done = False
+    while start < count:
+        stop = min(count, start + block)
+        need = (stop - 1) * hop_length + fft_len
+        if offset + len(buffer) < need and not source_done:
+            try:
+                bits = next(blocks)
+            except StopIteration:
+                source_done = True
+                bits = np.zeros(0, dtype=np.float32)
+            buffer = np.concatenate((buffer, bits))
+            if not padded_head and (len(buffer) > half or source_done):
+                buffer = np.pad(buffer, (half, 0), mode=pad_mode())
+                padded_head = True
+            if source_done:
+                # Right hand pad, from the tail of the real samples
+                buffer = np.pad(buffer, (0, half), mode=pad_mode())
+            continue
+        segment = buffer[start * hop_length - offset:need - offset]
+        yield mel_block(segment, bank, fft_len, hop_length,
+                        settings.spec_power)
+        start = stop
+        # Drop what no later frame reads, but keep half + 1 real samples
+        # for a reflect pad at the end
+        keep = min(start * hop_length, offset + len(buffer) - (half + 1))
+        if padded_head and not source_done and keep > offset:
+            buffer = buffer[keep - offset:]
+            offset = keep
+
+
+def write_stream(wav_file, out_file, settings,
+                 block_seconds=STREAM_BLOCK_SECONDS):
+    """
+    Name:       write_stream
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      write_wav(out_file, *decode_file(wav_file, settings)) a
+                block at a time: boosted and filtered at wav_file's own
+                rate by Filter, as 16 bit PCM through a WavWriter. Same
+                samples; the header has WavWriter's JUNK chunk, which
+                ffmpeg skips. Returns out_file.
+    """
+    rate, _ = audio_info(wav_file)
+    dsp = Filter(rate, settings.boost, int(settings.lowpass),
+                 int(settings.highpass))
+    with WavWriter(out_file, rate, 1, 16) as out:
+        for block in read_blocks(wav_file, block_seconds):
+            out.write(dsp.feed(block))
+    return out_file
+
+
+def mel_db_stream(wav_file, settings, block_seconds=STREAM_BLOCK_SECONDS,
+                  levels=None):
+    """
+    Name:       mel_db_stream
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      mel_db(*decode_file(wav_file, settings), settings) without
+                holding the audio or its STFT: same (mel_spec_db, rate,
+                hop_length), same floats. Only the n_mels x frames
+                result grows with the recording. levels is amplitude_db's.
+    """
+    plan = stream_plan(wav_file, settings)
+    logging.info('mel_db_stream(): %s, %0.0f s in %d frames', wav_file,
+                 plan["in_samples"] / plan["in_rate"], plan["frames"])
+    mel = np.empty((settings.n_mels, plan["frames"]), dtype=np.float32)
+    start = 0
+    for block in mel_stream(wav_file, settings, plan, block_seconds):
+        mel[:, start:start + block.shape[1]] = block
+        start += block.shape[1]
+    return (amplitude_db(mel, levels=levels), plan["rate"],
+            plan["hop_length"])
+
+
+def stream_seconds(wav_file):
+    """Length of wav_file in seconds from its header, 0 if unreadable."""
+    try:
+        rate, frames = audio_info(wav_file)
+    except RuntimeError:
+        return 0
+    return frames / float(rate)
+
+
+def long_recording(wav_file):
+    """True if wav_file should take the streaming path."""
+    return stream_seconds(wav_file) > STREAM_SECONDS
+
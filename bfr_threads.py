@@ -0,0 +1,99 @@
+"""
+
+Author: robertdcurrier@gmail.com
+Created:    2026-10-18
+Modified:   2026-10-18
+Notes:      Core budget for bfr runs. With one pool worker per core and
+            every worker letting BLAS, OpenCV and ffmpeg grab all cores
+            we end up with hundreds of runnable threads. Here we split a
+            fixed number of cores between the workers and pin every
+            thread pool in a worker to its share.
+"""
+import logging
+import os
+import resource
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    # Comes in with scikit-learn/librosa; env vars still cover new pools
+    threadpool_limits = None
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                   "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS",
+                   "NUMBA_NUM_THREADS")
+
+
+def available_cores():
+    """Cores this process may run on, honouring taskset/cgroup affinity."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def plan_budget(cores=None, workers=None):
+    """
+    Name:       plan_budget
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Splits cores between pool workers. cores defaults to what
+                we're allowed to run on, workers to one per core. Each
+                worker gets cores // workers threads (at least one).
+    """
+    cores = cores or available_cores()
+    workers = workers or cores
+    threads = max(1, cores // workers)
+    budget = {"cores": cores, "workers": workers, "threads": threads}
+    logging.info('plan_budget(): %d cores, %d workers, %d threads per worker',
+                 cores, workers, threads)
+    return budget
+
+
+def apply_budget(threads):
+    """
+    Name:       apply_budget
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Limits this process to threads threads. Env vars cover
+                pools started from here on (and subprocesses), cv2 and
+                threadpoolctl cover the ones already loaded by numpy.
+    """
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    try:
+        import cv2 as cv2
+        cv2.setNumThreads(threads)
+    except ImportError:
+        pass
+    if threadpool_limits is not None:
+        threadpool_limits(limits=threads)
+    logging.debug('apply_budget(): pid %d limited to %d threads',
+                  os.getpid(), threads)
+
+
+def cpu_seconds():
+    """User + system CPU seconds for us and our reaped children."""
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def report_utilization(cpu_start, wall_start, wall_end, cores):
+    """
+    Name:       report_utilization
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Logs CPU time used as a share of cores x wall time. Only
+                counts children once they've been joined.
+    """
+    wall = max(wall_end - wall_start, 1e-6)
+    used = cpu_seconds() - cpu_start
+    utilization = 100 * used / (wall * cores)
+    logging.info('report_utilization(): %0.1f CPU s in %0.1f s wall, '
+                 '%0.0f%% of %d cores', used, wall, utilization, cores)
+    return utilization
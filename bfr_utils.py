@@ -2,7 +2,7 @@
 
 Author: robertdcurrier@gmail.com
 Created:    2022-11-07
-Modified:   2022-11-07
+Modified:   2026-10-18
 Notes:      Utility routines for bfr to avoid duping in many tools
 """
 import glob
@@ -10,20 +10,12 @@ import logging
 import os
 import sys
 import time
-import librosa
 import json
 import argparse
 import itertools
-import numpy as np
-import cv2 as cv2
-import sox as sox
-import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
-from librosa import display
-from PIL import Image
 from natsort import natsorted
-from pydub import AudioSegment
-from scipy.signal import butter, filtfilt
+# librosa, matplotlib, cv2, sox, pydub and numpy are imported in the
+# functions that use them; see bfr_utils_BETA.
 
 
 def get_cli_args():
@@ -60,10 +52,15 @@ def mel_spec(wav_file, target) -> None:
     Name:       mel_spec
     Author:     robertdcurrier@gmail.com
     Created:    2021-11-10
-    Modified:   2022-11-12
+    Modified:   2026-10-18
     Notes:      Generates mel spec. Way too long; we need to break out
     into some shorter routines -> spec gen, rescale, fig gen.
     """
+    import librosa.display
+    import numpy as np
+    import cv2 as cv2
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Rectangle
     config = get_config()
     target = target
     taxa = 'beta'
@@ -261,13 +258,14 @@ def combine_wav(target) -> None:
     Name:       combine_wav
     Author:     robertdcurrier@gmail.com
     Created:    2021-11-10
-    Modified:   2022-01-26
+    Modified:   2026-10-18
     Notes:      Not currently in use. We now build one movie per wav file
                 Update: Going to use to build aggregated movie as this
                 is something Will wants. Note: We will need to boost and
                 SOX the combined wave file as we're working with the raw
                 WAVs to start...
     """
+    from pydub import AudioSegment
     config = get_config()
     wav_dir = config['targets'][target]['wav_dir']
     wav_out = config['targets'][target]['wav_out']
@@ -301,9 +299,10 @@ def soxfilter(wav_file, target) -> None:
     Name:       wav_to_mp3
     Author:     robertdcurrier@gmail.com
     Created:    2021-11-08
-    Modified:   2022-02-24
+    Modified:   2026-10-18
     Notes:      Changed name and doing high/low in one def
     """
+    import sox as sox
     config = get_config()
     wav_dir = config['targets'][target]["wav_dir"]
     fps = config['targets'][target]['fps']
@@ -410,9 +409,10 @@ def boost_audio(wav_file, target):
     Name:       boost_audio
     Author:     robertdcurrier@gmail.com
     Created:    2021-11-11
-    Modified:   2021-11-11
+    Modified:   2026-10-18
     Notes:      Boosts audio files by 'boost' dB.
     """
+    from pydub import AudioSegment
     config = get_config()
     base = os.path.basename(wav_file)
     no_ext = os.path.splitext(base)[0]
@@ -431,8 +431,10 @@ def boost_audio(wav_file, target):
 def header_footer(wav_file, target):
     """
     Notes: Loads tmp_mel and adds header and footer.
-    Modified: 2021-11-10
+    Modified: 2026-10-18
     """
+    import numpy as np
+    import cv2 as cv2
     logging.debug("header_footer(): Loading %s", wav_file)
     config = get_config()
     wav_dir = config['targets'][target]["wav_dir"]
@@ -470,10 +472,11 @@ def seek_biologics_wav(wav_file):
     Name:       seek_biologics_wav
     Author:     robertdcurrier@gmail.com
     Created:    2022-11-07
-    Modified:   2022-11-07
+    Modified:   2026-10-18
     Notes:      Hunts for biological signatures in wav files.  This will be moved
     to brf_utils.py when fully debugged. 
     """
+    from pydub import AudioSegment
     logging.info('seek_biologics(%s)', wav_file)
     audio = AudioSegment.from_wav(wav_file)
     # Here is where the magic lives...
@@ -484,10 +487,11 @@ def seek_biologics_png(png_file):
     Name:       seek_biologics_png
     Author:     robertdcurrier@gmail.com
     Created:    2022-11-07
-    Modified:   2022-11-16
+    Modified:   2026-10-18
     Notes:      Hunts for biological signatures using CORAL. We removed the annotation
     code and now this function returns only bounding boxes. Annotation is done elsewhere. 
     """
+    import cv2 as cv2
 
     config = get_config()
     args = get_cli_args()
@@ -534,10 +538,11 @@ def gen_coral(img, cons, png_file):
     Name:       gen_coral
     Author:     robertdcurrier@gmail.com
     Created:    2022-07-11
-    Modified:   2022-11-08
+    Modified:   2026-10-18
     Notes:      Iterates over PNG. Returns circle cons
     for generating bounding boxes.
     """
+    import cv2 as cv2
     logging.debug('gen_coral(%s)', png_file)
     config = get_config()
     args = get_cli_args()
@@ -589,11 +594,12 @@ def gen_cons(png_file):
     Name:       gen_cons
     Author:     robertdcurrier@gmail.com
     Created:    2022-07-04
-    Modified:   2022-11-07
+    Modified:   2026-10-18
     Notes:      Back to contours and edges. Mask works great in the
                 lab with clear water but barfs in the wild. Another negative
                 for mask is inability to deal with lighting variations.
     """
+    import cv2 as cv2
     # Taxa settings -- not in use during beta
     args = get_cli_args()
     target = args['target']
@@ -622,9 +628,10 @@ def gen_bboxes(cons):
     Name:       gen_bboxes
     Author:     robertdcurrier@gmail.com
     Created:    2022-07-11
-    Modified:   2022-11-09
+    Modified:   2026-10-18
     Notes:      
     """
+    import cv2 as cv2
     args = get_cli_args()
     target = args['target']
     config = get_config()
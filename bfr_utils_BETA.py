@@ -2,7 +2,7 @@
 
 Author: robertdcurrier@gmail.com
 Created:    2022-11-07
-Modified:   2022-11-07
+Modified:   2026-10-18
 Notes:      Utility routines for bfr to avoid duping in many tools
 """
 import glob
@@ -13,36 +13,65 @@ import time
 import datetime
 import json
 import argparse
-import itertools
+import subprocess
+import dataclasses
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
-import librosa
-import numpy as np
-import cv2 as cv2
-import sox as sox
-import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
-from librosa import display
-from PIL import Image
 from natsort import natsorted
-from pydub import AudioSegment
-from scipy.signal import butter, filtfilt
+# librosa, matplotlib, cv2, sox, pydub, numpy and pymongo (via bfr_dsp,
+# bfr_render and bfr_mongo too) are imported in the functions that use
+# them, so listing files or reading the config doesn't pay seconds of
+# imports. bfr_bench.py imports keeps an eye on it.
 # local imports
-from bfr_mongo import connect_mongo, insert_record, build_raw_doc
+from bfr_settings import ENCODE_PROFILES
+from bfr_threads import apply_budget
+from bfr_manifest import content_hash
+from bfr_scratch import make_worker_dir, make_file_dir, remove_dir
+from bfr_scheduler import Stage, MAX_TASKS_PER_CHILD
 detections = []
+# Set per pool worker by init_worker
+worker_settings = None
+worker_background = None
 
 def get_cli_args():
     """What it say.
 
     Author: robertdcurrier@gmail.com
     Created:    2018-11-06
-    Modified:   2021-12-06
+    Modified:   2026-10-18
 
     Notes: Starting out with just -t for target
+    -e picks an encode profile, overriding encode_profile in the config
+    -c/-w set the core budget and pool size, see bfr_threads
+    -F ignores the output manifest, see bfr_manifest
+    -s sets where scratch dirs go, see bfr_scratch
+    -S runs the staged scheduler, --stage_workers sizes its stages
+    -m sets how many pool tasks a worker runs before it is replaced
+    -b batches that many files per pool task through one batched STFT
     """
     arg_p = argparse.ArgumentParser()
     arg_p.add_argument("-t", "--target", help="target as defined in config file",
                        required='true')
+    arg_p.add_argument("-e", "--encode_profile", choices=sorted(ENCODE_PROFILES),
+                       help="MP4 encode profile (default from config)")
+    arg_p.add_argument("-c", "--cores", type=int,
+                       help="cores to use in total (default all)")
+    arg_p.add_argument("-w", "--workers", type=int,
+                       help="pool workers (default one per core)")
+    arg_p.add_argument("-F", "--force", action="store_true",
+                       help="reprocess everything, ignoring the manifest")
+    arg_p.add_argument("-s", "--scratch_root",
+                       help="scratch root (default /dev/shm if it has room)")
+    arg_p.add_argument("-m", "--max_tasks", type=int,
+                       default=MAX_TASKS_PER_CHILD,
+                       help="pool tasks per worker before it is recycled "
+                       "(default %d)" % MAX_TASKS_PER_CHILD)
+    arg_p.add_argument("-b", "--batch_size", type=int,
+                       help="files per batched STFT (default from config, 1)")
+    arg_p.add_argument("-S", "--staged", action="store_true",
+                       help="run each stage in its own pool, see bfr_scheduler")
+    arg_p.add_argument("--stage_workers",
+                       help="with -S, e.g. spectrogram:6,encode:2")
     args = vars(arg_p.parse_args())
     return args
 
@@ -60,45 +89,28 @@ def get_config() -> str:
     return config
 
 
-def mel_spec(wav_file, target) -> None:
+def mel_spec(wav_file, settings, bits=None, rate=None, mel=None,
+             background=None) -> None:
     """
     Name:       mel_spec
     Author:     robertdcurrier@gmail.com
     Created:    2021-11-10
-    Modified:   2022-11-12
+    Modified:   2026-10-18
     Notes:      Generates mel spec. Way too long; we need to break out
     into some shorter routines -> spec gen, rescale, fig gen.
+    Takes the already boosted/filtered samples from do_singles so we
+    don't have to read wav_file back off disk. wav_file is still used
+    for naming. Now broken out into mel_db (spec gen) and annotate_mel
+    (fig gen) so the staged scheduler can run them as separate stages.
+    mel is a (mel_spec_db, rate, hop_length) from mel_db_batch, in which
+    case bits aren't needed. background is the noise model's, for
+    find_rois.
     """
-    config = get_config()
-    target = target
-    taxa = 'beta'
-    # Config settings
-    wav_dir = config['targets'][target]["wav_dir"]
-    processed_dir = config["targets"][target]["processed_dir"]
-    pi = config["targets"][target]["pi"]
-    project = config["targets"][target]["project"]
-    tmp_dir = config["targets"][target]["tmp_dir"]
-    frame_x = config['targets'][target]['frame_x']
-    frame_y = config['targets'][target]['frame_y']
-    annotated_x = config['targets'][target]['annotated_x']
-    annotated_y = config['targets'][target]['annotated_y']
-    hop_length = config['targets'][target]["hop_length"]
-    spec_fmin = config['targets'][target]["spec_fmin"]
-    spec_fmax = config['targets'][target]["spec_fmax"]
-    spec_power = config['targets'][target]["spec_power"]
-    n_fft = config['targets'][target]["n_fft"]
-    n_mels = config['targets'][target]["n_mels"]
-    cmap = config['targets'][target]["cmap"]
-    base = os.path.basename(wav_file)
-    no_ext = os.path.splitext(base)[0]
-    fig_x = config['targets'][target]['fig_x']
-    fig_y = config['targets'][target]['fig_y']
-    spec_fsteps = config['targets'][target]['spec_fsteps']
-    dpi = config['targets'][target]['dpi']
-    edge_color = config['targets'][target]['taxa'][taxa]["edge_color"]
-
-    # End config settings
-
+    import cv2 as cv2
+    from bfr_dsp import load_audio
+    from bfr_render import render_mel
+    processed_dir = settings.processed_dir
+    tmp_dir = settings.tmp_dir
     base = os.path.basename(wav_file)
     no_ext = os.path.splitext(base)[0]
     tmp_mel = "%s/%s_mel.png" % (tmp_dir, no_ext)
@@ -106,103 +118,191 @@ def mel_spec(wav_file, target) -> None:
     raw_mel = "%s/%s_mel.png" % (processed_dir, no_ext)
 
     logging.info("mel_spec(): Generating mel spec for %s", wav_file)
-  
-    bits, rate = librosa.core.load(wav_file)
-    plt.figure(figsize=(fig_x, fig_y), dpi=dpi)
 
-    mel_spec = (librosa.feature.melspectrogram(bits, n_fft=n_fft,
-                hop_length=hop_length, n_mels = n_mels, sr=rate,
-                power=spec_power, fmax=spec_fmax, fmin=spec_fmin))
+    if mel is None:
+        if bits is None:
+            bits, rate = load_audio(wav_file)
+        mel = mel_db(bits, rate, settings)
+    mel_spec_db, rate, hop_length = mel
 
-    mel_spec_db = librosa.amplitude_to_db(mel_spec, ref=np.max)
+    # Draw once at frame_x x frame_y and write both copies from the buffer
+    image = render_mel(mel_spec_db, settings.cmap, settings.frame_x,
+                       settings.frame_y)
+    for png_file in (tmp_mel, raw_mel):
+        if not cv2.imwrite(png_file, image):
+            logging.warning("mel_spec(): Failed to write %s", png_file)
 
+    """ No BBOXES WHILE TESTING CLIPS """
+    bboxes = find_rois(mel, image, raw_mel, settings, background)
+    annotate_mel(wav_file, settings, mel_spec_db, rate, hop_length, bboxes)
+    return(len(bboxes))
 
-    img = librosa.display.specshow(mel_spec_db,sr=rate, \
-            hop_length=hop_length, x_axis='time',y_axis='mel',
-            fmax=spec_fmax, fmin=spec_fmin, cmap=cmap)
 
-    try:
-        plt.axis('off')
-        plt.savefig(tmp_mel, bbox_inches='tight', dpi=dpi, pad_inches=0)
-        plt.savefig(raw_mel, bbox_inches='tight', dpi=dpi, pad_inches=0)
-    except IOError as e:
-        logging.warning("Failed to write fig. Error: %s", e)
-        plt.close()
-    
-    # Resize from tmp_mel and raw_mel size so we're cool for ffmpeg
-    image = (cv2.imread(tmp_mel))
-    image = cv2.resize(image,(frame_x,frame_y))
-    cv2.imwrite(tmp_mel, image)
-    image = (cv2.imread(raw_mel))
-    image = cv2.resize(image,(frame_x,frame_y))
-    cv2.imwrite(raw_mel, image)
+def mel_db(bits, rate, settings, levels=None):
+    """
+    Name:       mel_db
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Spec gen half of mel_spec. Returns the mel spectrogram in
+    dB plus the rate and hop_length it was computed at, which the
+    annotated figure needs for its axes. float32 all the way; the dB
+    conversion reuses the mel buffer. levels is amplitude_db's.
+    """
+    from bfr_dsp import (analysis_plan, prepare_analysis, mel_power,
+                         amplitude_db)
+    spec_fmin = settings.spec_fmin
+    spec_fmax = settings.spec_fmax
+    n_mels = settings.n_mels
+    plan = analysis_plan(rate, spec_fmax, settings.n_fft, settings.hop_length,
+                         settings.analysis_mode, settings.fft_mode)
+    bits, rate = prepare_analysis(bits, rate, plan)
+    n_fft = plan["n_fft"]
+    hop_length = plan["hop_length"]
+    # melspectrogram, but with the mel basis and window cached per worker
+    mel_spec = mel_power(bits, rate, n_fft, hop_length, n_mels, spec_fmin,
+                         spec_fmax, settings.spec_power,
+                         fft_len=plan["fft_len"])
+    mel_spec_db = amplitude_db(mel_spec, levels=levels)
+    return mel_spec_db, rate, hop_length
+
+
+def mel_db_batch(audio, settings, levels=None):
+    """
+    Name:       mel_db_batch
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      mel_db for a list of (bits, rate), through the batched
+    engine in bfr_stft. Recordings are grouped by rate and length, as
+    only equal length rows stack, and each group goes through mel_batch
+    in slices that fit in STFT_BATCH_BYTES and settings.batch_size.
+    Returns a (mel_spec_db, rate, hop_length) per recording, in order.
+    Each mel_spec_db is a view into its slice's mel_batch output. A
+    levels list gets an amplitude_db levels dict per recording.
+    """
+    import numpy as np
+    from bfr_dsp import analysis_plan, prepare_analysis, amplitude_db
+    from bfr_stft import mel_batch, batch_limit
+    groups = {}
+    for index, (bits, rate) in enumerate(audio):
+        plan = analysis_plan(rate, settings.spec_fmax, settings.n_fft,
+                             settings.hop_length, settings.analysis_mode,
+                             settings.fft_mode)
+        bits, new_rate = prepare_analysis(bits, rate, plan)
+        key = (new_rate, plan["n_fft"], plan["hop_length"], plan["fft_len"],
+               len(bits))
+        groups.setdefault(key, []).append((index, bits))
+    results = [None] * len(audio)
+    if levels is not None:
+        levels[:] = [{} for _ in audio]
+    for (rate, n_fft, hop_length, fft_len, samples), members in groups.items():
+        size = min(settings.batch_size,
+                   batch_limit(samples, n_fft, hop_length, fft_len=fft_len))
+        for start in range(0, len(members), size):
+            chunk = members[start:start + size]
+            mels = mel_batch(np.stack([bits for _, bits in chunk]), rate,
+                             n_fft, hop_length, settings.n_mels,
+                             settings.spec_fmin, settings.spec_fmax,
+                             settings.spec_power,
+                             workers=settings.threads or -1, fft_len=fft_len)
+            for (index, _), mel in zip(chunk, mels):
+                level = levels[index] if levels is not None else None
+                results[index] = (amplitude_db(mel, levels=level), rate,
+                                  hop_length)
+    return results
+
+
+def annotate_mel(wav_file, settings, mel_spec_db, rate, hop_length, bboxes):
+    """
+    Name:       annotate_mel
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Fig gen half of mel_spec. Draws the labelled spectrogram
+    with the ROI boxes and writes <no_ext>_annotated.png to processed_dir.
+    bboxes are find_rois' start seconds, low Hz, seconds, Hz.
+    """
+    import librosa.display
+    import cv2 as cv2
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Rectangle
+    processed_dir = settings.processed_dir
+    pi = settings.pi
+    project = settings.project
+    annotated_x = settings.annotated_x
+    annotated_y = settings.annotated_y
+    spec_fmin = settings.spec_fmin
+    spec_fmax = settings.spec_fmax
+    spec_fsteps = settings.spec_fsteps
+    dpi = settings.dpi
+    edge_color = settings.taxa.edge_color
+    base = os.path.basename(wav_file)
+    no_ext = os.path.splitext(base)[0]
 
+    annotated_out = '%s/%s_annotated.png' % (processed_dir, no_ext)
     fig, ax = plt.subplots()
-
-    img = librosa.display.specshow(mel_spec_db,sr=rate, \
-            hop_length=hop_length, x_axis='time',y_axis='mel',
-            fmax=spec_fmax, fmin=spec_fmin, cmap=cmap)
-
-    """ No BBOXES WHILE TESTING CLIPS """
-    bboxes = seek_biologics_png(raw_mel)
-    parameters = get_transform_parameters(config, target) 
-    for bbox in bboxes:
-        (ax1,ay1,aw1,ah1) = transform_axes(bbox, parameters)
-        ax.add_patch(Rectangle((ax1, ay1), aw1, ah1,
-                        edgecolor = edge_color,
-                        fill=False,
-                        lw=1))
-    
-    fig.colorbar(img, ax=ax, format="%+2.f dB")
-    fig.gca().set_ylabel("Hz", fontsize=8)
-    fig.gca().set_xlabel("Seconds", fontsize=8)
-    fig.gca().set_yticks(range(spec_fmin, spec_fmax, spec_fsteps))
-
-    dts = wav_file.split('/')[1]
-    dts = dts.split('_')[0]
-    title = "\n%s: %s %s\n" % (pi, project, dts)
-    plt.title(title, fontsize=6, horizontalalignment='center')
-    
-    
+    # Always close fig, even when drawing or savefig blows up, so long
+    # lived pool workers don't pile up figures
     try:
-        annotated_out = '%s/%s_annotated.png' % (processed_dir, no_ext)
+        img = librosa.display.specshow(mel_spec_db,sr=rate, \
+                hop_length=hop_length, x_axis='time',y_axis='mel',
+                fmax=spec_fmax, fmin=spec_fmin, cmap=settings.cmap)
+
+        for (ax1,ay1,aw1,ah1) in bboxes.tolist():
+            ax.add_patch(Rectangle((ax1, ay1), aw1, ah1,
+                            edgecolor = edge_color,
+                            fill=False,
+                            lw=1))
+
+        fig.colorbar(img, ax=ax, format="%+2.f dB")
+        fig.gca().set_ylabel("Hz", fontsize=8)
+        fig.gca().set_xlabel("Seconds", fontsize=8)
+        fig.gca().set_yticks(range(spec_fmin, spec_fmax, spec_fsteps))
+
+        dts = os.path.basename(wav_file)
+        dts = dts.split('_')[0]
+        title = "\n%s: %s %s\n" % (pi, project, dts)
+        plt.title(title, fontsize=6, horizontalalignment='center')
+
         plt.axis('on')
         plt.savefig(annotated_out, bbox_inches='tight', dpi=dpi, pad_inches=0)
     except IOError as e:
         logging.warning("Failed to write %s. Error: %s", annotated_out, e)
-        plt.close()
-    plt.close()
+        return
+    finally:
+        logging.debug("annotate_mel(): Closing fig")
+        plt.close(fig)
     # Resize so we're cool for viewing
     image = (cv2.imread(annotated_out))
     image = cv2.resize(image,(annotated_x,annotated_y))
     cv2.imwrite(annotated_out, image)
-    logging.debug("mel_spec(): Closing fig")
-    plt.close()
-    return(len(bboxes))
 
 
-def get_transform_parameters(config, target):
+def get_transform_parameters(settings):
     """
     Name:       get_transform_parameters
     Author:     robertdcurrier@gmail.com
     Created:    2022-11-14
-    Modified:   2022-11-14
-    Notes:      Get parameters from config file for performing
+    Modified:   2026-10-18
+    Notes:      Get parameters from target settings for performing
                 axes transformation: rt, ph, pw, xfactor, yfactor and fmin,
                 fmax, etc.
 
                 Return fmin, fmax, xfac, yfac and ph 
+                ph is used by transform_boxes.
     """
-    spec_fmin = config['targets'][target]['spec_fmin']
-    spec_fmax = config['targets'][target]['spec_fmax']
-    pw = config['targets'][target]['frame_x']
-    ph = config['targets'][target]['frame_y']
-    rt = config['targets'][target]['recording_seconds']
+    spec_fmin = settings.spec_fmin
+    spec_fmax = settings.spec_fmax
+    pw = settings.frame_x
+    ph = settings.frame_y
+    rt = settings.recording_seconds
     xfac = pw/rt 
     yfac = spec_fmax/ph 
     parameters = { 
                     "xfac" : xfac,
-                    "yfac" : yfac
+                    "yfac" : yfac,
+                    "ph" : ph
                 }
 
     return parameters
@@ -244,63 +344,100 @@ def transform_axes(bbox, parameters):
     return(x, y, w, h)
 
 
-def combine_wav(target) -> None:
+def transform_boxes(bboxes, parameters):
+    """
+    Name:       transform_boxes
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      transform_axes on a whole (N, 4) box array at once.
+    Returns (N, 4) float64 x seconds, y Hz, w seconds, h Hz. Flips y
+    about the frame height in parameters rather than transform_axes'
+    fixed 320, which only held for 320 pixel high frames.
+    """
+    import numpy as np
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    x = bboxes[:, 0] / parameters["xfac"]
+    y = (parameters["ph"] - (bboxes[:, 1] + bboxes[:, 3])) * parameters["yfac"]
+    w = bboxes[:, 2] / parameters["xfac"]
+    h = bboxes[:, 3] * parameters["yfac"]
+    return np.stack((x, y, w, h), axis=1)
+
+
+def combine_wav(settings) -> None:
     """
     Name:       combine_wav
     Author:     robertdcurrier@gmail.com
     Created:    2021-11-10
-    Modified:   2022-01-26
+    Modified:   2026-10-18
     Notes:      Not currently in use. We now build one movie per wav file
                 Update: Going to use to build aggregated movie as this
                 is something Will wants. Note: We will need to boost and
                 SOX the combined wave file as we're working with the raw
                 WAVs to start...
+                Used to add AudioSegments in a loop, copying everything
+                so far on every file. Now the header is written once and
+                each file's PCM is appended a block at a time by
+                WavWriter, so time is linear and memory flat in the
+                length of the deployment. The output takes the highest
+                rate, channel count and width of the inputs, as pydub
+                did; only files that differ get converted.
     """
-    config = get_config()
-    wav_dir = config['targets'][target]['wav_dir']
-    wav_out = config['targets'][target]['wav_out']
-    fps = config['targets'][target]['fps']
+    from bfr_wav import WavWriter, parse_header, WAVE_FORMAT_PCM
+    wav_dir = settings.wav_dir
+    wav_out = settings.wav_out
 
     wav_files = []
     logging.info("combine_wav(): Getting list of wav files...")
 
-    wav_files = get_file_names(wav_dir)
+    wav_files = get_wav_file_names(wav_dir)
     if len(wav_files) == 0:
         logging.info("combine_wav(): No files found.")
         sys.exit()
 
-    # Create and empty to get us going
-    combinedWavFile = AudioSegment.empty()
-
-    # Now iterate
+    headers = {}
     for wav_file in wav_files:
-        logging.info("combine_wav(): Adding %s to combinedWavFile", wav_file)
-        combinedWavFile = combinedWavFile + AudioSegment.from_file(wav_file)
+        try:
+            headers[wav_file] = parse_header(wav_file)
+        except (ValueError, OSError) as e:
+            logging.warning("combine_wav(): Skipping %s: %s", wav_file, e)
+    if not headers:
+        logging.warning("combine_wav(): No readable WAVs in %s", wav_dir)
+        sys.exit()
+    rate = max(header['rate'] for header in headers.values())
+    channels = max(header['channels'] for header in headers.values())
+    # Float WAVs get written as the widest integer PCM we have
+    bits = max([header['bits'] for header in headers.values()
+                if header['format'] == WAVE_FORMAT_PCM] or [16])
+
+    with WavWriter(wav_out, rate, channels, bits) as combined:
+        for wav_file in headers:
+            logging.info("combine_wav(): Adding %s to %s", wav_file, wav_out)
+            combined.append(wav_file)
+        seconds_long = combined.frames / float(rate)
 
     # Get length so we can calculate frame count
-    seconds_long = combinedWavFile.duration_seconds
-    logging.debug("combine_wav(): combinedWavFile is %d seconds long", seconds_long)
-    logging.debug("combine_wav(): Writing combinedWavFile as wav")
-    combinedWavFile.export(wav_out, format='wav')
+    logging.info("combine_wav(): %s is %d seconds long", wav_out,
+                 seconds_long)
+    return wav_out
 
 
-def soxfilter(wav_file, target) -> None:
+def soxfilter(wav_file, settings) -> None:
     """
     Name:       wav_to_mp3
     Author:     robertdcurrier@gmail.com
     Created:    2021-11-08
-    Modified:   2022-02-24
+    Modified:   2026-10-18
     Notes:      Changed name and doing high/low in one def
     """
-    config = get_config()
-    wav_dir = config['targets'][target]["wav_dir"]
-    fps = config['targets'][target]['fps']
-    lowpass = int(config['targets'][target]['lowpass'])
-    highpass = int(config['targets'][target]['highpass'])
+    import sox as sox
+    wav_dir = settings.wav_dir
+    fps = settings.fps
+    lowpass = int(settings.lowpass)
+    highpass = int(settings.highpass)
     base = os.path.basename(wav_file)
     no_ext = os.path.splitext(base)[0]
-    sox_out = "tmp/%s_sox.wav" % no_ext
-    sox_tmp = "tmp/%s_sox_tmp.wav" % no_ext
+    sox_out = "%s/%s_sox.wav" % (settings.tmp_dir, no_ext)
 
 
     # Run sox lowpass
@@ -360,97 +497,231 @@ def clean_tmp_files():
     logging.debug("clean_tmp_files(): Removed all files in tmp")
 
 
-def ffmpeg_it(wav_file, target):
+def ffmpeg_it(wav_file, settings, frame):
     """
     Name: ffmpeg_it
     Author: robertdcurrier@gmail.com
     Created: 2021-11-09
-    Modified: 2021-11-10
+    Modified: 2026-10-18
     Notes: Incorporated into this code to eliminate need for
-    shell script.  For now we use the os command but plan on
-    integrating into ffmpeg library for Python3
+    shell script. Now ONE ffmpeg run per file: the header+mel frame from
+    header_footer is piped in as raw BGR, looped, scroll-cropped and
+    scaled in a single filter graph, and muxed with wav_file. No more
+    frames.mp4 and no second decode/encode. Returns True on success;
+    a non-zero ffmpeg exit is logged with its stderr. x264 settings
+    come from settings.encode_profile (see ENCODE_PROFILES).
     """
+    import numpy as np
     logging.info('ffmpeg_it(%s)', wav_file)
-    config = get_config()
-    processed_dir = config['targets'][target]['processed_dir']
+    processed_dir = settings.processed_dir
     base = os.path.basename(wav_file)
     no_ext = os.path.splitext(base)[0]
-    target = target
-    wav_dir = config['targets'][target]["wav_dir"]
-    sox_in = "%s/%s_boosted_sox.wav" % (processed_dir, no_ext)
-    processed_dir = config["targets"][target]["processed_dir"]
-    recording_seconds = int(config['targets'][target]['recording_seconds'])
-    frame_x = int(config['targets'][target]['frame_x'])
-
-
-    loop_command = """ffmpeg -loglevel quiet -y -loop 1 -t %d -i tmp/%s_final.png -vf "crop=w=%d:h=ih:x='(iw-%d)*t/%d':y=0" -r 24 -pix_fmt yuv420p tmp/%s_frames.mp4""" % (recording_seconds, no_ext, frame_x, frame_x, recording_seconds, no_ext)
-    logging.debug(loop_command)
-    os.system(loop_command)
-    logging.debug('ffmpeg_it(): Synchronizing audio and video for %s', wav_file)
-    mix_command = """ffmpeg -loglevel quiet -y -i tmp/%s_frames.mp4  -i tmp/%s.wav -vf scale=%d:320 -framerate 24 -c:v libx264 -pix_fmt yuv420p -profile:v baseline -level 3.0 -crf 20 -preset veryslow -c:a aac -strict experimental -movflags +faststart -threads 0 %s/%s_processed.mp4""" % (no_ext, no_ext, frame_x, processed_dir, no_ext)
-    os.system(mix_command)
-    logging.debug(mix_command)
-    logging.info('ffmpeg_it(): Finished building %s_final.mp4', no_ext)
+    recording_seconds = settings.recording_seconds
+    frame_x = int(settings.frame_x)
+    frame_y = int(settings.frame_y)
+    fps = settings.fps
+    mp4_out = "%s/%s_processed.mp4" % (processed_dir, no_ext)
+    (height, width) = frame.shape[:2]
+
+    # loop the single input frame forever at fps, then slide a frame_x
+    # window from the header across to the end of the mel over the clip
+    filter_graph = ("[0:v]loop=loop=-1:size=1:start=0,setpts=N/(%d*TB),"
+                    "crop=w=%d:h=ih:x='(iw-%d)*t/%g':y=0,scale=%d:%d,"
+                    "format=yuv420p[v]" % (fps, frame_x, frame_x,
+                                           recording_seconds, frame_x,
+                                           frame_y))
+    command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+               "-f", "rawvideo", "-pix_fmt", "bgr24",
+               "-s", "%dx%d" % (width, height), "-framerate", str(fps),
+               "-i", "pipe:0", "-i", wav_file,
+               "-filter_complex", filter_graph,
+               "-map", "[v]", "-map", "1:a",
+               "-t", "%g" % recording_seconds, "-r", str(fps),
+               "-c:v", "libx264", "-profile:v", "baseline", "-level", "3.0"]
+    command += encode_args(settings.encode_profile, settings.threads)
+    command += ["-c:a", "aac", "-movflags", "+faststart", mp4_out]
+    logging.debug('ffmpeg_it(): %s', " ".join(command))
+    try:
+        result = subprocess.run(command, input=np.ascontiguousarray(frame).tobytes(),
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE)
+    except OSError as e:
+        logging.warning('ffmpeg_it(): Could not run ffmpeg: %s', e)
+        return False
+    if result.returncode != 0:
+        logging.warning('ffmpeg_it(): ffmpeg exited %d for %s: %s',
+                        result.returncode, no_ext,
+                        result.stderr.decode(errors='replace').strip())
+        return False
+    logging.info('ffmpeg_it(): Finished building %s', mp4_out)
+    return True
+
+
+def encode_args(profile, threads=0):
+    """
+    Name:       encode_args
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      ffmpeg x264 arguments for one of ENCODE_PROFILES. threads,
+                when set, is the worker's share of the core budget and
+                wins over the profile's thread count.
+    """
+    options = dict(ENCODE_PROFILES[profile])
+    if threads:
+        options["threads"] = threads
+    args = ["-preset", options["preset"], "-crf", str(options["crf"])]
+    if options["tune"]:
+        args += ["-tune", options["tune"]]
+    if options["gop"]:
+        args += ["-g", str(options["gop"])]
+    args += ["-threads", str(options["threads"])]
+    return args
 
 
-def boost_audio(wav_file, target):
+def boost_audio(wav_file, settings):
     """
     Name:       boost_audio
     Author:     robertdcurrier@gmail.com
     Created:    2021-11-11
-    Modified:   2021-11-11
+    Modified:   2026-10-18
     Notes:      Boosts audio files by 'boost' dB.
     """
-    config = get_config()
+    from pydub import AudioSegment
     base = os.path.basename(wav_file)
     no_ext = os.path.splitext(base)[0]
-    boost = config['targets'][target]['boost']
+    boost = settings.boost
     logging.info("boost_audio(): Boosting %s by %d dB", wav_file, boost)
     try:
         audio = AudioSegment.from_wav(wav_file)
         audio = audio + boost
     except:
         logging.warning('boost_audio(): Failed to boost %s', wav_file)
-    boost_file = 'tmp/%s_boosted.wav' % no_ext
+    boost_file = '%s/%s_boosted.wav' % (settings.tmp_dir, no_ext)
     audio.export(boost_file,format='wav')
     return(boost_file)
 
 
-def header_footer(wav_file, target):
+def header_footer(wav_file, settings, image=None):
     """
     Notes: Loads tmp_mel and adds header and footer.
-    Modified: 2021-11-10
+    Returns the combined BGR frame for ffmpeg_it rather than writing
+    _final.png. Pass the mel image to skip reading tmp_mel. The header
+    is decoded and resized once per process by header_image. Errors
+    are logged and raised; run_file and run_stages turn them into a
+    failed result. sys.exit() here used to take a pool worker down
+    without one.
+    Modified: 2026-10-18
     """
+    import numpy as np
+    import cv2 as cv2
+    from bfr_render import header_image
     logging.debug("header_footer(): Loading %s", wav_file)
-    config = get_config()
-    wav_dir = config['targets'][target]["wav_dir"]
-    tmp_dir = config['targets'][target]["tmp_dir"]
-    processed_dir = config["targets"][target]["processed_dir"]
-    fps = config['targets'][target]['fps']
+    tmp_dir = settings.tmp_dir
 
     base = os.path.basename(wav_file)
     no_ext = os.path.splitext(base)[0]
     tmp_mel = "%s/%s_mel.png" % (tmp_dir, no_ext)
-    final_out = "%s/%s_final.png" % (tmp_dir, no_ext)
-    frame_x = config['targets'][target]['frame_x']
-    frame_y = config['targets'][target]['frame_y']
-    header_x = config['targets'][target]['header_x']
-    footer_x = config['targets'][target]['footer_x']
+    frame_x = settings.frame_x
+    frame_y = settings.frame_y
+    header_x = settings.header_x
+    footer_x = settings.footer_x
 
-    header = config['targets'][target]["header"]
-    footer = config['targets'][target]["footer"]
+    header = settings.header
+    footer = settings.footer
 
     try:
 
-        image = (cv2.imread(tmp_mel))
-        header = (cv2.imread(header))
+        if image is None:
+            image = (cv2.imread(tmp_mel))
+        header = header_image(header, header_x, frame_y)
+        if header is None:
+            raise IOError("can't read %s" % settings.header)
         image = cv2.resize(image,(frame_x,frame_y))
-        header = cv2.resize(header,(header_x,frame_y))
         image = np.append(header, image, axis=1)
-        cv2.imwrite(final_out, image)
     except Exception as e:
         logging.warning("header_footer(): Encountered error %s", e)
-        sys.exit()
+        raise
+    return image
+
+
+def find_rois(mel, image, png_file, settings, background=None):
+    """
+    Name:       find_rois
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Runs the taxa's detector. mel is mel_db's (mel_spec_db,
+    rate, hop_length), image the rendered frame CORAL works on. Either
+    way we return an (N, 4) float64 array of start seconds, low Hz,
+    seconds, Hz for annotate_mel; len() of it is the ROI count.
+    background is a per-band noise floor on mel_spec_db's scale, from
+    bfr_noise.file_background, or None. The db detector measures
+    against it instead of the file's own medians; CORAL gets its own
+    frame rendered with it subtracted, while image stays what we write
+    out.
+    """
+    from bfr_noise import subtract_background
+    from bfr_render import render_mel
+    mel_spec_db, rate, hop_length = mel
+    if settings.taxa.detector == "db":
+        return seek_biologics_db(mel_spec_db, rate, hop_length, png_file,
+                                 settings, background)
+    if background is not None:
+        image = render_mel(subtract_background(mel_spec_db, background),
+                           settings.cmap, settings.frame_x, settings.frame_y)
+    bboxes = seek_biologics_array(image, png_file, settings)
+    return transform_boxes(bboxes, get_transform_parameters(settings))
+
+
+def seek_biologics_db(mel_spec_db, rate, hop_length, png_file, settings,
+                      floor=None):
+    """
+    Name:       seek_biologics_db
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Detector that skips the colormapped PNG. gist_ncar isn't
+    monotonic in luminance, so thresh_min/con_edges_* on the gray frame
+    are hard to tune and cost a render. Here each mel band is
+    normalized by its noise floor (floor, or the band's median) and
+    cells over taxa.db_thresh dB are grouped with
+    connectedComponentsWithStats. Regions shorter than db_min_seconds
+    or narrower than db_min_hz are dropped and the rest merged by
+    merge_iou. The min/max_roi_* pixel bounds are CORAL's, sized for
+    its padded circles, and don't apply. Returns seconds/Hz boxes like
+    find_rois; png_file only names the debug image.
+    """
+    from bfr_detect import (noise_floor, db_regions, region_axes, mel_edges,
+                            axes_bounds, merge_boxes, region_pixels)
+    taxa = settings.taxa
+    if floor is None:
+        floor = noise_floor(mel_spec_db)
+    edges = mel_edges(mel_spec_db.shape[0], settings.spec_fmin,
+                      settings.spec_fmax)
+    regions = db_regions(mel_spec_db, floor, taxa.db_thresh)
+    found = len(regions)
+    regions = regions[axes_bounds(region_axes(regions, rate, hop_length,
+                                              edges), taxa)]
+    if taxa.merge_iou > 0:
+        regions = merge_boxes(regions, taxa.merge_iou)
+    logging.debug('seek_biologics_db(%s): %d regions -> %d ROIs', png_file,
+                  found, len(regions))
+    if settings.debug:
+        import cv2 as cv2
+        mask = mel_spec_db[::-1] > (floor[::-1] + taxa.db_thresh)[:, None]
+        mask = cv2.resize(mask.astype('uint8') * 255,
+                          (settings.frame_x, settings.frame_y),
+                          interpolation=cv2.INTER_NEAREST)
+        mask = cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR)
+        pixels = region_pixels(regions, mel_spec_db.shape, settings.frame_x,
+                               settings.frame_y)
+        for x1, y1, width, height in pixels.tolist():
+            cv2.rectangle(mask, (x1, y1), (x1 + width, y1 + height),
+                          taxa.rect_color, taxa.line_thick)
+        no_ext = os.path.splitext(os.path.basename(png_file))[0]
+        cv2.imwrite("%s/%s_DB.png" % (settings.debug_dir, no_ext), mask)
+    return region_axes(regions, rate, hop_length, edges)
 
 
 def seek_biologics_wav(wav_file):
@@ -458,94 +729,103 @@ def seek_biologics_wav(wav_file):
     Name:       seek_biologics_wav
     Author:     robertdcurrier@gmail.com
     Created:    2022-11-07
-    Modified:   2022-11-07
+    Modified:   2026-10-18
     Notes:      Hunts for biological signatures in wav files.  This will be moved
     to brf_utils.py when fully debugged. 
+    Maps the file with WavReader rather than decoding it all up front;
+    read_clip() pulls out just the stretch we want to look at.
     """
+    from bfr_wav import WavReader
     logging.info('seek_biologics(%s)', wav_file)
-    audio = AudioSegment.from_wav(wav_file)
+    audio = WavReader(wav_file)
     # Here is where the magic lives...
 
 
-def seek_biologics_png(png_file):
+def seek_biologics_png(png_file, settings):
     """
     Name:       seek_biologics_png
     Author:     robertdcurrier@gmail.com
     Created:    2022-11-07
-    Modified:   2022-11-16
+    Modified:   2026-10-18
     Notes:      Hunts for biological signatures using CORAL. We removed the annotation
     code and now this function returns only bounding boxes. Annotation is done elsewhere. 
+    Now just loads the PNG and hands off to seek_biologics_array. Kept for
+    batch re-analysis of old processed_dir content.
     """
+    import cv2 as cv2
+    from bfr_detect import empty_boxes
+    logging.info('seek_biologics_png(%s)', png_file)
+    img = cv2.imread(png_file)
+    if img is None:
+        logging.warning('seek_biologics_png(): Failed to open %s', png_file)
+        return empty_boxes()
+    return seek_biologics_array(img, png_file, settings)
 
-    config = get_config()
-    args = get_cli_args()
-    target = args['target']
-    taxa = "beta"
 
-    debug_dir = config['targets'][target]['debug_dir']
-    logging.info('seek_biologics_png(%s)', png_file)
-        
-    try:
-        img = cv2.imread(png_file)
-    except:
-        logging.warning('load_image(): Failed to open %s' % png_file)
-        return
-    
-    contours = gen_cons(png_file)
-    circ_cons = gen_coral(img.copy(), contours, png_file)
-    bboxes = gen_bboxes(circ_cons)
+def seek_biologics_array(img, png_file, settings):
+    """
+    Name:       seek_biologics_array
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      CORAL on an in-memory BGR or grayscale spectrogram so
+    mel_spec doesn't have to read back the PNG it just wrote. png_file is
+    only used to name the debug images. Returns gen_bboxes' (N, 4)
+    array.
+    """
+    import cv2 as cv2
+    debug_dir = settings.debug_dir
+    logging.debug('seek_biologics_array(%s)', png_file)
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+    contours = gen_cons(img, png_file, settings)
+    circ_cons = gen_coral(img.copy(), contours, png_file, settings)
+    bboxes = gen_bboxes(circ_cons, settings)
     
-    rect_color = eval('%s' % config['targets'][target]['taxa'][taxa]["rect_color"])
+    rect_color = settings.taxa.rect_color
    
-    line_thick = config['targets'][target]['taxa'][taxa]["line_thick"]
-    for bbox in bboxes:
-        x1 = bbox[0]
-        y1 = bbox[1]
-        width = bbox[2]
-        height = bbox[3]
+    line_thick = settings.taxa.line_thick
+    # Don't scribble on the caller's frame
+    img = img.copy()
+    for x1, y1, width, height in bboxes.tolist():
         x2 = x1+width
         y2 = y1+height
         cv2.rectangle(img,(x1,y1),(x2,y2), (rect_color), line_thick)    
     (root, fname) = os.path.split(png_file)
     no_ext = os.path.splitext(fname)[0]
     cons_f = "%s/%s_CONS.png" % (debug_dir, no_ext)
-    logging.debug('seek_biologics_png(): Writing contours %s', cons_f)
+    logging.debug('seek_biologics_array(): Writing contours %s', cons_f)
     cv2.imwrite(cons_f, img)
     return bboxes
 
 
-def gen_coral(img, cons, png_file):
+def gen_coral(img, cons, png_file, settings):
     """
     Name:       gen_coral
     Author:     robertdcurrier@gmail.com
     Created:    2022-07-11
-    Modified:   2022-11-08
+    Modified:   2026-10-18
     Notes:      Iterates over PNG. Returns circle cons
-    for generating bounding boxes.
+    for generating bounding boxes. Circles are painted by
+    bfr_detect.paint_circles.
     """
+    import cv2 as cv2
+    from bfr_detect import paint_circles
     logging.debug('gen_coral(%s)', png_file)
-    config = get_config()
-    args = get_cli_args()
-    target = args['target']
-    taxa = "beta"
-    debug = config['targets'][target]["debug"]
+    debug = settings.debug
 
-    debug_dir = config['targets'][target]['debug_dir']
-    line_thick = config['targets'][target]['taxa'][taxa]['line_thick']
-    radius_boost = config['targets'][target]['taxa'][taxa]['radius_boost']
+    debug_dir = settings.debug_dir
+    line_thick = settings.taxa.line_thick
+    radius_boost = settings.taxa.radius_boost
 
     # circles
-    circle_img = img.copy()
-    for con in cons:
-        (x,y), radius = cv2.minEnclosingCircle(con)
-        center = (int(x), int(y))
-        radius = int(radius+radius_boost)
-        cv2.circle(circle_img, center, radius, (0,0,0), -1)
+    circle_img = paint_circles(img.copy(), cons, radius_boost)
     
-    edges_min = config['targets'][target]['taxa'][taxa]['coral_edges_min']
-    edges_max = config['targets'][target]['taxa'][taxa]['coral_edges_max']
-    thresh_min = config['targets'][target]['taxa'][taxa]['thresh_min']
-    thresh_max = config['targets'][target]['taxa'][taxa]['thresh_max']
+    edges_min = settings.taxa.coral_edges_min
+    edges_max = settings.taxa.coral_edges_max
+    thresh_min = settings.taxa.thresh_min
+    thresh_max = settings.taxa.thresh_max
 
     gray  = cv2.cvtColor(circle_img, cv2.COLOR_BGR2GRAY)
     blurred = cv2.GaussianBlur(gray, (3,3), cv2.BORDER_WRAP)
@@ -569,125 +849,552 @@ def gen_coral(img, cons, png_file):
     return(circ_cons)
 
 
-def gen_cons(png_file):
+def gen_cons(img, png_file, settings):
     """
     Name:       gen_cons
     Author:     robertdcurrier@gmail.com
     Created:    2022-07-04
-    Modified:   2022-11-07
+    Modified:   2026-10-18
     Notes:      Back to contours and edges. Mask works great in the
                 lab with clear water but barfs in the wild. Another negative
                 for mask is inability to deal with lighting variations.
+                Takes the BGR frame instead of re-reading png_file.
+                One findContours, CHAIN_APPROX_SIMPLE, and the RAW_CONS
+                image only when debugging: on a noisy 1920x1080 frame
+                the second findContours and that 2px drawContours were
+                over half of detection time.
     """
-    # Taxa settings -- not in use during beta
-    args = get_cli_args()
-    target = args['target']
-    taxa = "beta"
-
-    config = get_config()
-    debug_dir = config['targets'][target]['debug_dir']
-    edges_min = config['targets'][target]['taxa'][taxa]['con_edges_min']
-    edges_max = config['targets'][target]['taxa'][taxa]['con_edges_max']
+    import cv2 as cv2
+    debug_dir = settings.debug_dir
+    edges_min = settings.taxa.con_edges_min
+    edges_max = settings.taxa.con_edges_max
     no_ext = os.path.splitext(png_file)[0]
     
 
     logging.debug('gen_cons(%s)' % png_file)
 
-    img = frame = cv2.imread(png_file)
     gray  = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     blurred = cv2.GaussianBlur(gray, (3,3), cv2.BORDER_WRAP)
     edges = cv2.Canny(blurred, edges_min, edges_max)
-    raw_contours, _ = (cv2.findContours(edges, cv2.RETR_TREE,
-                                        cv2.CHAIN_APPROX_NONE))
+    # SIMPLE keeps every hull point, which is all minEnclosingCircle uses
     contours, _ = (cv2.findContours(edges, cv2.RETR_TREE,
-                                    cv2.CHAIN_APPROX_NONE))
-    cimg = cv2.drawContours(blurred, raw_contours, -1, (255,255,255), 2)
-    (root, fname) = os.path.split(png_file)
-    no_ext = os.path.splitext(fname)[0]
-    raw_f = "%s/%s_RAW_CONS.png" % (debug_dir, no_ext)
-    cv2.imwrite(raw_f, cimg)
+                                    cv2.CHAIN_APPROX_SIMPLE))
+    if settings.debug:
+        cimg = cv2.drawContours(blurred, contours, -1, (255,255,255), 2)
+        (root, fname) = os.path.split(png_file)
+        no_ext = os.path.splitext(fname)[0]
+        raw_f = "%s/%s_RAW_CONS.png" % (debug_dir, no_ext)
+        cv2.imwrite(raw_f, cimg)
     
     return contours
 
 
-def gen_bboxes(cons):
+def gen_bboxes(cons, settings):
     """
     Name:       gen_bboxes
     Author:     robertdcurrier@gmail.com
     Created:    2022-07-11
-    Modified:   2022-11-09
-    Notes:      
-    """
-    args = get_cli_args()
-    target = args['target']
-    config = get_config()
-    taxa = "beta"
-    bboxes = []
-    good_cons = []
-    ncons = len(cons)
-    logging.debug('gen_bboxes(): %d circ_cons' % ncons)
-
-    min_roi_area = config['targets'][target]['taxa'][taxa]['min_roi_area']
-    max_roi_area = config['targets'][target]['taxa'][taxa]['max_roi_area']
-    min_roi_w = config['targets'][target]['taxa'][taxa]['min_roi_w']
-    max_roi_w = config['targets'][target]['taxa'][taxa]['max_roi_w']
-    min_roi_h = config['targets'][target]['taxa'][taxa]['min_roi_h']
-    max_roi_h = config['targets'][target]['taxa'][taxa]['max_roi_h']
-    
-    for con in cons:
-        rect = cv2.boundingRect(con)
-        x1 = rect[0]
-        y1 = rect[1]
-        width = rect[2]
-        height = rect[3]
-        x2 = x1+width
-        y2 = y1+height
-        area = width*height
-        
-        logging.debug('gen_bboxes() Width: %d Height: %d', width, height)
-        if width > min_roi_w and width < max_roi_w:
-            if height > min_roi_h and height < max_roi_h:
-                bboxes.append([x1,y1,width,height])
-    bboxes = list(bboxes for bboxes,_ in itertools.groupby(bboxes))
+    Modified:   2026-10-18
+    Notes:      Bounding boxes of the CORAL contours as an (N, 4) int32
+                array of x, y, w, h, filtered on every min/max_roi_*
+                bound and truly deduped (groupby only caught repeats
+                next to each other), merged by IoU if the taxa asks.
+                See bfr_detect.
+    """
+    from bfr_detect import contour_boxes, select_boxes
+    logging.debug('gen_bboxes(): %d circ_cons' % len(cons))
+    bboxes = select_boxes(contour_boxes(cons), settings.taxa)
     logging.debug('gen_bboxes(): Found %d ROIs' % (len(bboxes)))
     return (bboxes)
 
 
+def init_worker(settings, rate=None, background=None) -> None:
+    """
+    Name:       init_worker
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Pool initializer. Stashes the resolved target settings
+                built in bfr() so workers never re-read the config, and
+                holds BLAS/OpenCV to this worker's share of the cores.
+                Then warms the worker up; rate is the sample rate of the
+                recordings, from probe_rate(). background is the noise
+                model's at the start of the run, if the target uses one.
+    """
+    global worker_settings, worker_background
+    worker_background = background
+    # tmp_dir is the run's scratch dir; give this worker its own corner
+    worker_settings = dataclasses.replace(
+        settings, tmp_dir=make_worker_dir(settings.tmp_dir))
+    if settings.threads:
+        apply_budget(settings.threads)
+    warm_worker(settings, rate)
+
+
+def warm_worker(settings, rate=None):
+    """
+    Name:       warm_worker
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Does the once-per-process work up front so the first file
+    a worker gets costs the same as the rest: the imports, the colormap
+    LUT, the resized header, matplotlib's font cache, a tiny specshow
+    with annotate_mel's time/mel axes and, if we know the
+    rate, one pass of mel_db over a second of noise. That last one fills
+    the mel_bank cache (basis + window) and gets librosa's numba code
+    compiled. Returns the seconds it took.
+    """
+    import io
+    import numpy as np
+    import librosa.display
+    import matplotlib.pyplot as plt
+    from bfr_render import cmap_lut, header_image
+    start_time = time.perf_counter()
+    cmap_lut(settings.cmap)
+    header_image(settings.header, settings.header_x, settings.frame_y)
+    fig = plt.figure(figsize=(1, 1))
+    try:
+        librosa.display.specshow(np.zeros((2, 2), dtype=np.float32),
+                                 sr=rate or 22050, x_axis='time',
+                                 y_axis='mel', cmap=settings.cmap,
+                                 ax=fig.gca())
+        fig.text(0.5, 0.5, "0 Hz")
+        fig.savefig(io.BytesIO(), format='png')
+    finally:
+        plt.close(fig)
+    if rate:
+        noise = np.random.default_rng(0).standard_normal(
+            max(int(rate), 2 * settings.n_fft)).astype(np.float32)
+        mel_db(noise, rate, settings)
+    seconds = time.perf_counter() - start_time
+    logging.debug('warm_worker(): pid %d warm in %0.2f s', os.getpid(), seconds)
+    return seconds
+
+
+def probe_rate(wav_file):
+    """
+    Name:       probe_rate
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Sample rate from the WAV header, without pulling in the
+    audio stack. Float WAVs are fine now we parse the header in
+    bfr_wav. None if it can't be read.
+    """
+    from bfr_wav import wav_info
+    info = wav_info(wav_file)
+    if info is None:
+        logging.debug('probe_rate(): Can\'t read a rate from %s', wav_file)
+        return None
+    return info[0]
+
+
 def do_singles(file) -> None:
     """
     Created:    2021-12-06
     Author:     robertdcurrier@gmail.com
-    Modified:   2022-01-26
-    Notes:      This replaces the for file in loop we used previously
+    Modified:   2026-10-18
+    Notes:      This replaces the for file in loop we used previously.
+    Settings come from init_worker. Each file gets its own scratch dir
+    which is removed as soon as the file is done. A file that raises
+    comes back as a failed result record rather than taking the whole
+    imap_unordered run down with it.
+    """
+    return run_file(file)
+
+
+def run_file(file, audio=None, mel=None, levels=None):
+    """
+    Name:       run_file
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      process_file in its own scratch dir under the worker's,
+    with exceptions turned into a failed result record. audio, mel and
+    levels are passed through for do_batch, the worker's noise
+    background always.
+    """
+    no_ext = os.path.splitext(os.path.basename(file))[0]
+    file_dir = make_file_dir(worker_settings.tmp_dir, no_ext)
+    try:
+        settings = dataclasses.replace(worker_settings, tmp_dir=file_dir)
+        return process_file(file, settings, audio, mel, worker_background,
+                            levels)
+    except Exception as e:
+        logging.warning('run_file(): %s failed: %s', file, e)
+        return {"file": file, "ok": False, "error": str(e)}
+    finally:
+        remove_dir(file_dir)
+
+
+def do_batch(files):
     """
-    args = get_cli_args()
-    config = get_config()
+    Name:       do_batch
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Pool task for -b: decodes files, runs their spectrograms
+    through mel_db_batch in one go, then does the rest of each file on
+    its own. Decode and spectrogram time is split evenly over the batch
+    in each record's timings; their peak RSS is the batch's. With
+    noise_model on, each file's amplitude_db levels go along too.
+    Returns a list of result records.
+    """
+    from bfr_memory import track_peak
+    settings = worker_settings
+    results = []
+    decoded = []
+    batch_peaks = {}
+    start_time = time.perf_counter()
+    with track_peak("decode", batch_peaks):
+        for file in files:
+            try:
+                decoded.append((file, decode_file(file, settings)))
+            except Exception as e:
+                logging.warning('do_batch(): %s failed: %s', file, e)
+                results.append({"file": file, "ok": False, "error": str(e)})
+    if not decoded:
+        return results
+    decode_share = (time.perf_counter() - start_time) / len(decoded)
+    start_time = time.perf_counter()
+    levels = [] if settings.noise_model else None
+    try:
+        with track_peak("spectrogram", batch_peaks):
+            mels = mel_db_batch([audio for _, audio in decoded], settings,
+                                levels)
+    except Exception as e:
+        logging.warning('do_batch(): spectrograms failed: %s', e)
+        return results + [{"file": file, "ok": False, "error": str(e)}
+                          for file, _ in decoded]
+    mel_share = (time.perf_counter() - start_time) / len(decoded)
+    for index, ((file, audio), mel) in enumerate(zip(decoded, mels)):
+        result = run_file(file, audio, mel,
+                          levels[index] if levels is not None else None)
+        timings = result.setdefault("timings", {})
+        timings["decode"] = decode_share
+        timings["spectrogram"] = timings.get("spectrogram", 0) + mel_share
+        peaks = result.setdefault("peaks", {})
+        for step, peak in batch_peaks.items():
+            peaks[step] = max(peak, peaks.get(step, 0))
+        results.append(result)
+    return results
+
+
+def process_file(file, settings, audio=None, mel=None, background=None,
+                 levels=None):
+    """
+    Name:       process_file
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      The per-file pipeline that used to live in do_singles.
+    Audio is decoded once and boosted/filtered in memory; the WAV is
+    only written for ffmpeg. Intermediates go to settings.tmp_dir.
+    Returns a result record for the manifest in bfr(), with seconds
+    spent in each step under "timings" and the worker's peak RSS in MB
+    during each under "peaks". do_batch hands in the decoded audio and
+    the mel spectrogram it has already made. Recordings over
+    STREAM_SECONDS are never decoded whole: their spectrogram and the
+    WAV for ffmpeg are both streamed off disk (see bfr_stream), so
+    memory stays flat however long they are.
+    With noise_model on, background goes to detection on this file's dB
+    scale and the file's own band floors go back under "noise" for the
+    model; levels are amplitude_db's for mel when it is handed in.
+    """
+    from bfr_dsp import write_wav
+    from bfr_noise import file_background, file_noise
+    from bfr_memory import track_peak
+    from bfr_stream import (long_recording, mel_db_stream, write_stream,
+                            audio_info)
     base = os.path.basename(file)
     no_ext = os.path.splitext(base)[0]
     # Single files
-    target = args['target']
     logging.debug('do_singles(): processing file %s', file)
+    timings = {}
+    peaks = {}
+    if mel is None and settings.noise_model:
+        levels = {}
+
+    if mel is None and audio is None and long_recording(file):
+        start_time = time.perf_counter()
+        with track_peak("stream", peaks):
+            mel = mel_db_stream(file, settings, levels=levels)
+        timings["stream"] = time.perf_counter() - start_time
+        # No samples in memory; the encode step streams the WAV too
+        bits = None
+        rate = audio_info(file)[0]
+    else:
+        if audio is None:
+            start_time = time.perf_counter()
+            with track_peak("decode", peaks):
+                audio = decode_file(file, settings)
+            timings["decode"] = time.perf_counter() - start_time
+        bits, rate = audio
+    # Keep the old sox file name as everything downstream keys off it
+    sox_file = "%s/%s_boosted_sox.wav" % (settings.tmp_dir, no_ext)
+    start_time = time.perf_counter()
+    with track_peak("spectrogram", peaks):
+        if mel is None:
+            mel = mel_db(bits, rate, settings, levels)
+        if settings.noise_model:
+            background = file_background(background, rate, levels, mel[0])
+        roi = mel_spec(sox_file, settings, bits, rate, mel, background)
+    timings["spectrogram"] = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    with track_peak("persist", peaks):
+        persist_file(file, settings, roi)
+    timings["persist"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with track_peak("encode", peaks):
+        frame = header_footer(sox_file, settings)
+        # ffmpeg is the only consumer of the filtered audio on disk
+        if bits is None:
+            write_stream(file, sox_file, settings)
+        else:
+            write_wav(sox_file, bits, rate)
+        ok = ffmpeg_it(sox_file, settings, frame)
+    timings["encode"] = time.perf_counter() - start_time
+    logging.debug('bfr(): Finished single file processing %s', file)
+    result = result_record(file, sox_file, settings, ok, roi)
+    result["timings"] = timings
+    result["peaks"] = peaks
+    if settings.noise_model:
+        result["noise"] = file_noise(rate, levels)
+    return result
 
-    boost_file = boost_audio(file, target)
-    sox_file = soxfilter(boost_file, target)
-    # need to run spec on SOX file, not just BOOST file yo!
-    roi = mel_spec(sox_file, target)
+
+def decode_file(file, settings):
+    """
+    Name:       decode_file
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Loads file and applies boost and the low/highpass filters.
+    Returns (bits, rate).
+    """
+    from bfr_dsp import load_audio, boost_filter
+    boost = settings.boost
+    lowpass = int(settings.lowpass)
+    highpass = int(settings.highpass)
+    bits, rate = load_audio(file)
+    logging.info("decode_file(): Boosting %s by %d dB, lowpass %d", file,
+                 boost, lowpass)
+    bits = boost_filter(bits, rate, boost, lowpass, highpass)
+    return bits, rate
+
+
+def persist_file(file, settings, roi):
+    """
+    Name:       persist_file
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Writes the roi_detections and raw_files docs for file.
+    """
+    from bfr_mongo import insert_record, build_raw_doc
     # Turn file name into proper date-time format
     basename = os.path.basename(file)
     no_ext = os.path.splitext(basename)[0]
     format = "%Y%m%dT%H%M%S"
     tstamp = datetime.datetime.strptime(no_ext, format)
     dts = tstamp.strftime('%Y-%m-%d %H:%M:%S')
-    pi = config['targets'][target]['pi']
-    project = config['targets'][target]['project']
+    pi = settings.pi
+    project = settings.project
     roi_doc = ('{"pi":"%s","project":"%s","file":"%s","roi":%d,"timestamp":"%s"}' %
               (pi, project, file, roi, dts))
     roi_json = json.loads(roi_doc)
     insert_record("roi_detections", roi_json)
-    raw_doc = build_raw_doc(config, args, file)
+    raw_doc = build_raw_doc(settings, file)
     insert_record("raw_files", raw_doc)
 
-    header_footer(sox_file, target)
-    ffmpeg_it(sox_file, target)
-    logging.debug('bfr(): Finished single file processing %s', file)
 
+def result_record(file, sox_file, settings, ok, roi):
+    """
+    Name:       result_record
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      What bfr() gets back for each file, for the manifest.
+    A PNG can fail to write without failing ffmpeg_it, so ok also
+    needs every artifact on disk; a file missing one isn't recorded
+    and gets retried next run.
+    """
+    sox_no_ext = os.path.splitext(os.path.basename(sox_file))[0]
+    artifacts = ["%s/%s_mel.png" % (settings.processed_dir, sox_no_ext),
+                 "%s/%s_annotated.png" % (settings.processed_dir, sox_no_ext),
+                 "%s/%s_processed.mp4" % (settings.processed_dir, sox_no_ext)]
+    missing = [artifact for artifact in artifacts
+               if not os.path.exists(artifact)]
+    result = {
+        "file": file,
+        "ok": ok and not missing,
+        "roi": roi,
+        "sha1": content_hash(file),
+        "artifacts": artifacts,
+    }
+    if ok and missing:
+        result["error"] = "missing %s" % ", ".join(missing)
+    return result
+
+
+def stage_decode(job, settings):
+    """
+    Name:       stage_decode
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Staged pipeline, decode/DSP. Makes the file's scratch dir
+    under the run dir and writes the filtered WAV for the encode stage
+    so later stages don't have to ship the samples around. If this
+    fails the dir goes with it; after this run_stages removes it.
+    """
+    from bfr_dsp import write_wav
+    file = job["file"]
+    no_ext = os.path.splitext(os.path.basename(file))[0]
+    tmp_dir = make_file_dir(settings.tmp_dir, no_ext)
+    sox_file = "%s/%s_boosted_sox.wav" % (tmp_dir, no_ext)
+    try:
+        bits, rate = decode_file(file, settings)
+        write_wav(sox_file, bits, rate)
+    except Exception:
+        remove_dir(tmp_dir)
+        raise
+    job.update(tmp_dir=tmp_dir, sox_file=sox_file, bits=bits, rate=rate)
+    return job
+
+
+def stage_spectrogram(job, settings):
+    """
+    Name:       stage_spectrogram
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Staged pipeline, spectrogram + ROI detection (find_rois).
+    The file's band floors ride along under "noise" for the noise model.
+    """
+    from bfr_noise import file_background, file_noise
+    from bfr_render import render_mel
+    sox_no_ext = os.path.splitext(os.path.basename(job["sox_file"]))[0]
+    raw_mel = "%s/%s_mel.png" % (settings.processed_dir, sox_no_ext)
+    logging.info("stage_spectrogram(): Generating mel spec for %s",
+                 job["file"])
+    wav_rate = job.pop("rate")
+    levels = {} if settings.noise_model else None
+    mel_spec_db, rate, hop_length = mel_db(job.pop("bits"), wav_rate,
+                                           settings, levels)
+    image = render_mel(mel_spec_db, settings.cmap, settings.frame_x,
+                       settings.frame_y)
+    background = None
+    if settings.noise_model:
+        background = file_background(worker_background, wav_rate, levels,
+                                     mel_spec_db)
+        job["noise"] = file_noise(wav_rate, levels)
+    bboxes = find_rois((mel_spec_db, rate, hop_length), image, raw_mel,
+                       settings, background)
+    job.update(mel_spec_db=mel_spec_db, rate=rate, hop_length=hop_length,
+               image=image, bboxes=bboxes)
+    return job
+
+
+def stage_render(job, settings):
+    """
+    Name:       stage_render
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Staged pipeline, rendering. Writes the raw and annotated
+    PNGs and builds the header+mel frame for the encode stage. Runs in
+    processes as pyplot isn't thread safe.
+    """
+    import cv2 as cv2
+    sox_file = job["sox_file"]
+    sox_no_ext = os.path.splitext(os.path.basename(sox_file))[0]
+    raw_mel = "%s/%s_mel.png" % (settings.processed_dir, sox_no_ext)
+    image = job.pop("image")
+    bboxes = job.pop("bboxes")
+    if not cv2.imwrite(raw_mel, image):
+        logging.warning("stage_render(): Failed to write %s", raw_mel)
+    annotate_mel(sox_file, settings, job.pop("mel_spec_db"), job.pop("rate"),
+                 job.pop("hop_length"), bboxes)
+    job.update(roi=len(bboxes), frame=header_footer(sox_file, settings, image))
+    return job
+
+
+def stage_encode(job, settings):
+    """
+    Name:       stage_encode
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Staged pipeline, video encode. ffmpeg does the work so a
+    thread per encode is all we need here.
+    """
+    job["ok"] = ffmpeg_it(job["sox_file"], settings, job.pop("frame"))
+    return job
+
+
+def stage_persist(job, settings):
+    """
+    Name:       stage_persist
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Staged pipeline, DB persistence. Last stage, so it also
+    drops the file's scratch dir and returns the result record.
+    """
+    file = job["file"]
+    persist_file(file, settings, job["roi"])
+    remove_dir(job["tmp_dir"])
+    result = result_record(file, job["sox_file"], settings, job["ok"],
+                           job["roi"])
+    if "noise" in job:
+        result["noise"] = job["noise"]
+    return result
+
+
+def build_stages(settings, cores, stage_workers=None, rate=None,
+                 background=None):
+    """
+    Name:       build_stages
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Stages for run_stages(). Default workers add up to
+    cores, each being one busy thread or ffmpeg: an eighth each to decode
+    and encode, a quarter to render, one persist thread and the rest,
+    about half, to spectrogram+detection, which is where the time goes.
+    Every stage gets at least one, so under 5 cores we run a few over.
+    stage_workers (name -> workers, from --stage_workers) wins, and
+    spectrogram takes what's left after it. Process stage workers are
+    held to one thread each, as is ffmpeg, and are warmed up by
+    init_worker, which also hands them background.
+    """
+    workers = {
+        "decode": max(1, cores // 8),
+        "render": max(1, cores // 4),
+        "encode": max(1, cores // 8),
+        "persist": 1,
+    }
+    workers.update(stage_workers or {})
+    fixed = ("decode", "render", "encode", "persist")
+    workers.setdefault("spectrogram",
+                       max(1, cores - sum(workers[name] for name in fixed)))
+    settings = dataclasses.replace(settings, threads=1)
+    layout = (("decode", stage_decode, "process"),
+              ("spectrogram", stage_spectrogram, "process"),
+              ("render", stage_render, "process"),
+              ("encode", stage_encode, "thread"),
+              ("persist", stage_persist, "thread"))
+    logging.info('build_stages(): %s on %d cores', ", ".join(
+        "%s %d" % (name, workers[name]) for name, _, _ in layout), cores)
+    stages = []
+    for name, func, kind in layout:
+        stage = Stage(name, func, kind, workers[name], args=(settings,))
+        if kind == "process":
+            stage = dataclasses.replace(stage, initializer=init_worker,
+                                        initargs=(settings, rate,
+                                                  background))
+        stages.append(stage)
+    return stages
@@ -0,0 +1,380 @@
+"""
+
+Author: robertdcurrier@gmail.com
+Created:    2026-10-18
+Modified:   2026-10-18
+Notes:      Memory mapped reader for the uncompressed PCM WAVs our
+            hydrophones write. We parse the RIFF header ourselves and
+            map the data chunk with numpy.memmap, so opening a file
+            costs nothing and slicing is free. Samples only get read in,
+            converted to float32 and mixed down for the frames asked
+            for, a block at a time. The scaling is libsndfile's (int16
+            / 32768 etc.), so read() gives the same floats as
+            librosa.core.load(sr=None, mono=True). Anything else
+            (compressed, MP3, broken headers) raises ValueError and the
+            callers fall back to librosa/soundfile.
+            WavWriter goes the other way: header once, PCM appended a
+            block at a time, sizes patched on close. Past 4 GB it turns
+            the file into RF64, so month long aggregates still open.
+"""
+import struct
+import numpy as np
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# Frames converted per step in read() and blocks()
+READ_BLOCK_FRAMES = 1 << 20
+# RIFF sizes are 32 bit; RF64 puts the real ones in a ds64 chunk
+RIFF_MAX = 0xFFFFFFFF
+# ds64 body: riff size, data size, sample count, table length
+DS64_FORMAT = '<QQQI'
+# (format, bits) -> memmap dtype and the scale libsndfile reads it with
+SAMPLE_TYPES = {
+    (WAVE_FORMAT_PCM, 8): ('u1', 1 / 128),
+    (WAVE_FORMAT_PCM, 16): ('<i2', 1 / 32768),
+    (WAVE_FORMAT_PCM, 24): ('u1', 1 / 2147483648),
+    (WAVE_FORMAT_PCM, 32): ('<i4', 1 / 2147483648),
+    (WAVE_FORMAT_IEEE_FLOAT, 32): ('<f4', None),
+    (WAVE_FORMAT_IEEE_FLOAT, 64): ('<f8', None),
+}
+
+
+def parse_header(wav_file):
+    """
+    Name:       parse_header
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      Walks the RIFF chunks of wav_file. Returns a dict with
+                format, channels, rate, bits, block_align, data_offset
+                and frames. RF64 data sizes come from the ds64 chunk. A
+                data chunk that claims more than the file holds
+                (recorders that died mid file) is cut to what is there.
+    """
+    with open(wav_file, 'rb') as handle:
+        riff = handle.read(12)
+        if (len(riff) < 12 or riff[:4] not in (b'RIFF', b'RF64') or
+                riff[8:12] != b'WAVE'):
+            raise ValueError("%s: not a RIFF/WAVE file" % wav_file)
+        header = {}
+        ds64_data = None
+        while True:
+            chunk = handle.read(8)
+            if len(chunk) < 8:
+                break
+            chunk_id, size = struct.unpack('<4sI', chunk)
+            start = handle.tell()
+            if chunk_id == b'fmt ':
+                fmt = handle.read(size)
+                if len(fmt) < 16:
+                    raise ValueError("%s: short fmt chunk" % wav_file)
+                (code, channels, rate, _, block_align,
+                 bits) = struct.unpack('<HHIIHH', fmt[:16])
+                if code == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                    # First two bytes of the SubFormat GUID
+                    code = struct.unpack('<H', fmt[24:26])[0]
+                header.update(format=code, channels=channels, rate=rate,
+                              bits=bits, block_align=block_align)
+            elif chunk_id == b'ds64':
+                ds64 = handle.read(size)
+                if len(ds64) >= 16:
+                    ds64_data = struct.unpack('<Q', ds64[8:16])[0]
+            elif chunk_id == b'data':
+                if size == RIFF_MAX and ds64_data is not None:
+                    size = ds64_data
+                handle.seek(0, 2)
+                available = handle.tell() - start
+                header.update(data_offset=start,
+                              data_bytes=min(size, available))
+                break
+            handle.seek(start + size + (size & 1))
+    if 'format' not in header or 'data_offset' not in header:
+        raise ValueError("%s: no fmt or data chunk" % wav_file)
+    if (header['format'], header['bits']) not in SAMPLE_TYPES:
+        raise ValueError("%s: format %d/%d bit not supported" %
+                         (wav_file, header['format'], header['bits']))
+    if not header['channels'] or not header['block_align']:
+        raise ValueError("%s: bad fmt chunk" % wav_file)
+    header['frames'] = header['data_bytes'] // header['block_align']
+    return header
+
+
+class WavReader:
+    """
+    Name:       WavReader
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      with WavReader(wav_file) as wav:
+                    clip = wav.read_clip(10.0, 12.5)
+                samples is the raw (frames, channels) memmap, int16 etc.
+                as stored; 24 bit is (frames, channels, 3) bytes. read()
+                and friends hand back float32 copies of just the frames
+                asked for.
+    """
+    def __init__(self, wav_file):
+        header = parse_header(wav_file)
+        self.wav_file = wav_file
+        self.rate = header['rate']
+        self.channels = header['channels']
+        self.bits = header['bits']
+        self.frames = header['frames']
+        dtype, self.scale = SAMPLE_TYPES[(header['format'], header['bits'])]
+        shape = (self.frames, self.channels)
+        if self.bits == 24:
+            shape += (3,)
+        if self.frames:
+            self.samples = np.memmap(wav_file, dtype=dtype, mode='r',
+                                     offset=header['data_offset'],
+                                     shape=shape)
+        else:
+            self.samples = np.zeros(shape, dtype=dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Drops the mapping; views already handed out keep it alive."""
+        self.samples = None
+
+    @property
+    def seconds(self):
+        return self.frames / float(self.rate)
+
+    def _to_float(self, raw):
+        """float32 of a raw (frames, channels[, 3]) slice, libsndfile style."""
+        if self.bits == 24:
+            # Little endian 3 byte ints into the top of an int32
+            wide = np.zeros(raw.shape[:2], dtype=np.int32)
+            for index in range(3):
+                wide |= raw[..., index].astype(np.int32) << (8 * (index + 1))
+            raw = wide
+        # np.array rather than astype: a slice of the memmap stays a
+        # memmap through astype, and soxr and friends want an ndarray
+        out = np.array(raw, dtype=np.float32)
+        if self.bits == 8:
+            out -= 128
+        if self.scale is not None:
+            out *= np.float32(self.scale)
+        return out
+
+    def read(self, start=0, stop=None, channel=None):
+        """
+        Name:       read
+        Author:     robertdcurrier@gmail.com
+        Created:    2026-10-18
+        Modified:   2026-10-18
+        Notes:      float32 samples for frames start:stop. channel picks
+                    one channel; None mixes down with the same mean
+                    librosa.to_mono takes. Converts READ_BLOCK_FRAMES at
+                    a time so a stereo file never has a float copy of
+                    both channels in memory.
+        """
+        start, stop, _ = slice(start, stop).indices(self.frames)
+        out = np.empty(max(0, stop - start), dtype=np.float32)
+        for offset in range(start, stop, READ_BLOCK_FRAMES):
+            end = min(stop, offset + READ_BLOCK_FRAMES)
+            out[offset - start:end - start] = self._mono(
+                self.samples[offset:end], channel)
+        return out
+
+    def read_channels(self, start=0, stop=None):
+        """float32 (frames, channels) copy of frames start:stop, unmixed."""
+        start, stop, _ = slice(start, stop).indices(self.frames)
+        return self._to_float(self.samples[start:max(start, stop)])
+
+    def _mono(self, raw, channel):
+        if channel is not None:
+            return self._to_float(raw[:, channel:channel + 1])[:, 0]
+        block = self._to_float(raw)
+        if self.channels == 1:
+            return block[:, 0]
+        return np.mean(block.T, axis=-2)
+
+    def read_clip(self, start_seconds, stop_seconds, channel=None):
+        """read() by time rather than frame."""
+        return self.read(int(round(start_seconds * self.rate)),
+                         int(round(stop_seconds * self.rate)), channel)
+
+    def blocks(self, size, channel=None):
+        """float32 mono blocks of size frames, front to back."""
+        for start in range(0, self.frames, size):
+            yield self.read(start, start + size, channel)
+
+
+class WavWriter:
+    """
+    Name:       WavWriter
+    Author:     robertdcurrier@gmail.com
+    Created:    2026-10-18
+    Modified:   2026-10-18
+    Notes:      with WavWriter(wav_out, 48000, 1) as out:
+                    out.write(bits)
+                Integer PCM only. The header goes out up front with a
+                JUNK chunk holding room for ds64, and the sizes are
+                patched in on close. Nothing but the block being written
+                is held in memory.
+    """
+    def __init__(self, wav_file, rate, channels, bits=16):
+        if (WAVE_FORMAT_PCM, bits) not in SAMPLE_TYPES:
+            raise ValueError("%d bit PCM not supported" % bits)
+        self.wav_file = wav_file
+        self.rate = int(rate)
+        self.channels = channels
+        self.bits = bits
+        self.block_align = channels * bits // 8
+        self.data_bytes = 0
+        self.handle = open(wav_file, 'wb')
+        ds64_size = struct.calcsize(DS64_FORMAT)
+        self.handle.write(b'RIFF' + struct.pack('<I', 0) + b'WAVE')
+        self.handle.write(b'JUNK' + struct.pack('<I', ds64_size) +
+                          bytes(ds64_size))
+        self.handle.write(b'fmt ' + struct.pack(
+            '<IHHIIHH', 16, WAVE_FORMAT_PCM, channels, self.rate,
+            self.rate * self.block_align, self.block_align, bits))
+        self.handle.write(b'data' + struct.pack('<I', 0))
+        self.data_offset = self.handle.tell()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def frames(self):
+        return self.data_bytes // self.block_align
+
+    def write_raw(self, data):
+        """Appends PCM bytes already in this file's format."""
+        data = memoryview(data).cast('B')
+        if len(data) % self.block_align:
+            raise ValueError("%d bytes isn't whole frames" % len(data))
+        self.handle.write(data)
+        self.data_bytes += len(data)
+
+    def write(self, bits):
+        """
+        Name:       write
+        Author:     robertdcurrier@gmail.com
+        Created:    2026-10-18
+        Modified:   2026-10-18
+        Notes:      Appends float samples in [-1, 1], (frames,) for mono
+                    or (frames, channels). Clipped and scaled like
+                    bfr_dsp.write_wav.
+        """
+        bits = np.asarray(bits)
+        if bits.ndim == 1:
+            bits = bits[:, None]
+        if bits.shape[1] != self.channels:
+            raise ValueError("%d channels into a %d channel file" %
+                             (bits.shape[1], self.channels))
+        full = 2 ** (self.bits - 1)
+        # float32 can't hold 2^31 - 1, so 24/32 bit go via float64
+        work = np.float32 if self.bits <= 16 else np.float64
+        pcm = np.clip(bits.astype(work, copy=False), -1.0, (full - 1) / full)
+        pcm = pcm * full
+        if self.bits == 8:
+            pcm = (pcm + 128).astype(np.uint8)
+        elif self.bits == 24:
+            wide = pcm.astype('<i4')
+            pcm = wide.view(np.uint8).reshape(wide.shape + (4,))[..., :3]
+        else:
+            pcm = pcm.astype(SAMPLE_TYPES[(WAVE_FORMAT_PCM, self.bits)][0])
+        self.write_raw(np.ascontiguousarray(pcm))
+
+    def append(self, wav_file, block_frames=READ_BLOCK_FRAMES):
+        """
+        Name:       append
+        Author:     robertdcurrier@gmail.com
+        Created:    2026-10-18
+        Modified:   2026-10-18
+        Notes:      Appends every frame of wav_file, block_frames at a
+                    time. Files already in our format are copied byte
+                    for byte off the memmap. Others are converted: soxr
+                    stream resample if the rate differs, mono spread
+                    over all channels (extra channels get silence), and
+                    requantized to our width. Returns frames written.
+        """
+        before = self.frames
+        with WavReader(wav_file) as wav:
+            if (wav.rate == self.rate and wav.channels == self.channels and
+                    wav.bits == self.bits and wav.scale is not None):
+                for start in range(0, wav.frames, block_frames):
+                    self.write_raw(np.ascontiguousarray(
+                        wav.samples[start:start + block_frames]))
+                return self.frames - before
+            resampler = None
+            if wav.rate != self.rate:
+                import soxr
+                resampler = soxr.ResampleStream(wav.rate, self.rate,
+                                                wav.channels,
+                                                dtype='float32',
+                                                quality='soxr_hq')
+            starts = range(0, wav.frames, block_frames)
+            for start in starts:
+                block = wav.read_channels(start, start + block_frames)
+                if resampler is not None:
+                    # soxr only takes a contiguous float32 ndarray
+                    block = np.ascontiguousarray(block, dtype=np.float32)
+                    last = start + block_frames >= wav.frames
+                    block = resampler.resample_chunk(block, last=last)
+                self.write(self._spread(block.reshape(len(block), -1)))
+        return self.frames - before
+
+    def _spread(self, block):
+        """Matches block's channels to ours."""
+        channels = block.shape[1]
+        if channels == self.channels:
+            return block
+        if channels == 1:
+            return np.repeat(block, self.channels, axis=1)
+        if channels < self.channels:
+            return np.pad(block, ((0, 0), (0, self.channels - channels)))
+        return block[:, :self.channels]
+
+    def close(self):
+        """
+        Name:       close
+        Author:     robertdcurrier@gmail.com
+        Created:    2026-10-18
+        Modified:   2026-10-18
+        Notes:      Pads the data chunk to even length and patches the
+                    sizes. Over RIFF_MAX the RIFF becomes RF64 and the
+                    JUNK chunk becomes the ds64 with the 64 bit sizes.
+        """
+        if self.handle is None:
+            return
+        if self.data_bytes & 1:
+            self.handle.write(b'\0')
+        riff_size = self.handle.tell() - 8
+        if riff_size > RIFF_MAX:
+            self.handle.seek(0)
+            self.handle.write(b'RF64' + struct.pack('<I', RIFF_MAX))
+            self.handle.seek(12)
+            self.handle.write(b'ds64')
+            self.handle.seek(20)
+            self.handle.write(struct.pack(DS64_FORMAT, riff_size,
+                                          self.data_bytes, self.frames, 0))
+            data_size = RIFF_MAX
+        else:
+            self.handle.seek(4)
+            self.handle.write(struct.pack('<I', riff_size))
+            data_size = self.data_bytes
+        self.handle.seek(self.data_offset - 4)
+        self.handle.write(struct.pack('<I', data_size))
+        self.handle.close()
+        self.handle = None
+
+
+def wav_info(wav_file):
+    """(rate, frames) from the header, or None if we can't map it."""
+    try:
+        header = parse_header(wav_file)
+    except (ValueError, OSError, struct.error):
+        return None
+    return header['rate'], header['frames']